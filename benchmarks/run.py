@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Замеры производительности скачивания и распаковки обновлений на локальной замене сервиса 1С.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run [--scenario single_large ...] [--scale 0.1] [--latency 0.05]
+                             [--bandwidth 100] [--output results.jsonl]
+
+Каждый сценарий выполняется в отдельном процессе, чтобы пиковый объем памяти (peak RSS)
+относился только к нему. Результаты выводятся в консоль и, при указании --output,
+дописываются в файл JSON-строк вместе с идентификатором текущего коммита для сравнения.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join as join_path
+
+MB = 1024 * 1024
+
+# Сценарии: дистрибутив платформы и/или конфигурации (количество, длина цепочки, размер архива, файлов в архиве)
+SCENARIOS = {
+    "single_large": {"platform": 300, "configurations": 0, "chain": 0, "size": 0, "files": 1, "unzip": False},
+    "many_small_chain": {"platform": 0, "configurations": 1, "chain": 40, "size": 2, "files": 1, "unzip": False},
+    "n_configurations": {"platform": 0, "configurations": 10, "chain": 3, "size": 10, "files": 1, "unzip": False},
+    "extraction_heavy": {"platform": 0, "configurations": 1, "chain": 2, "size": 50, "files": 5000, "unzip": True},
+}
+
+
+def build_service(name, scenario, args):
+    """Подготовка синтетических архивов и запуск локального сервиса обновлений.
+    @return: кортеж (сервис, адрес API, суммарный размер архивов в байтах).
+    """
+    from benchmarks.server import FakeUpdateService
+
+    data_dir = join_path(args.data, '{0}_{1}'.format(name, args.scale))
+    os.makedirs(data_dir, exist_ok=True)
+
+    service = FakeUpdateService(data_dir, args.latency, int(args.bandwidth * MB / 8))
+    if scenario["platform"]:
+        service.add_platform("8.3.99.1", int(scenario["platform"] * args.scale * MB))
+    for index in range(scenario["configurations"]):
+        service.add_configuration('Bench{0}'.format(index), "1.0.0.2", scenario["chain"],
+                                  int(scenario["size"] * args.scale * MB), scenario["files"])
+
+    total_bytes = sum(item["size"] for item in service.files().values())
+    return service, service.start(), total_bytes
+
+
+def build_settings(scenario, work_dir, args):
+    """Настройки обновления для сценария в формате settings.json."""
+    return {"templatePath": join_path(work_dir, 'Template'),
+            "platformPath": join_path(work_dir, 'Platform'),
+            "statePath": join_path(work_dir, 'state.db'),
+            "unzipFiles": scenario["unzip"],
+            "downloadChunkSize": args.chunk,
+            "downloadSegments": args.segments,
+            "concurrency": {"configurations": args.workers, "apiCalls": args.workers,
+                            "downloads": args.workers, "unzip": args.workers,
+                            "unzipThreads": args.workers, "pipelineQueue": 2},
+            "platform": {"startVersion": "8.3.0.1", "lastDownloaded": ""},
+            "configurations": [{"humanName": 'Bench{0}'.format(index), "programName": 'Bench{0}'.format(index),
+                                "startVersion": "1.0.0.1", "lastDownloaded": ""}
+                               for index in range(scenario["configurations"])]}
+
+
+def run_child(api_url, settings):
+    """Выполнение сценария в дочернем процессе и вывод результата последней строкой stdout.
+    Записи лога выводятся в stderr и показываются родительским процессом при ошибке сценария.
+    """
+    from utils import log, metrics, updateapi, worker
+
+    log.init(print_to_console=True, print_to_file=False, use_queue=False)
+    os.makedirs(settings["platformPath"], exist_ok=True)
+    os.makedirs(settings["templatePath"], exist_ok=True)
+
+    connector = updateapi.ApiConnector('bench', 'bench', None, settings.get("connection"))
+    connector.API_URL = api_url
+
+    started = time.perf_counter()
+    if settings["configurations"]:
+        worker.update_configurations(connector, settings)
+    else:
+        worker.update_platform(connector, settings)
+    wall_time = time.perf_counter() - started
+
+    connector.close()
+    log.close()
+
+    peak_rss = None
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss = peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+    except ImportError:
+        pass
+
+    def counter(name):
+        return sum(item["value"] for item in metrics.snapshot()["counters"] if item["name"] == name)
+
+    print(json.dumps({"wallTime": wall_time, "peakRss": peak_rss,
+                      "downloadBytes": counter('download_bytes'), "extractFiles": counter('extract_files')}))
+
+
+def git_commit():
+    """Идентификатор текущего коммита (для сравнения результатов между версиями)."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Замеры производительности скачивания и распаковки обновлений 1С.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='сценарий (по умолчанию все)')
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель размеров архивов')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа сервиса, с')
+    parser.add_argument('--bandwidth', type=float, default=0, help='скорость на соединение, Мбит/с (0 - без ограничения)')
+    parser.add_argument('--chunk', type=float, default=4, help='downloadChunkSize, Мб')
+    parser.add_argument('--segments', type=int, default=1, help='downloadSegments')
+    parser.add_argument('--workers', type=int, default=4, help='ограничения настройки concurrency')
+    parser.add_argument('--data', default=join_path(tempfile.gettempdir(), '1c_autoupdate_bench'),
+                        help='каталог для синтетических архивов (сохраняется между запусками)')
+    parser.add_argument('--output', help='файл JSON-строк для накопления результатов')
+    parser.add_argument('--child', nargs=2, metavar=('API_URL', 'SETTINGS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], json.loads(args.child[1]))
+        return
+
+    commit = git_commit()
+    failed = []
+    for name in args.scenario or sorted(SCENARIOS):
+        scenario = SCENARIOS[name]
+        service, api_url, total_bytes = build_service(name, scenario, args)
+        expected_files = scenario["configurations"] * scenario["chain"] * scenario["files"] if scenario["unzip"] else 0
+        work_dir = tempfile.mkdtemp(prefix='1c_autoupdate_run_')
+        try:
+            settings = build_settings(scenario, work_dir, args)
+            child = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--child', api_url, json.dumps(settings)],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+            service.stop()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        # Замер учитывается, только если скачаны и распакованы все опубликованные архивы
+        error = None
+        measured = None
+        if child.returncode != 0:
+            error = 'код завершения {0}'.format(child.returncode)
+        else:
+            measured = json.loads(child.stdout.decode().strip().splitlines()[-1])
+            if measured["downloadBytes"] != total_bytes:
+                error = 'скачано {0} байт из {1}'.format(measured["downloadBytes"], total_bytes)
+            elif measured["extractFiles"] != expected_files:
+                error = 'распаковано {0} файлов из {1}'.format(measured["extractFiles"], expected_files)
+        if error is not None:
+            sys.stderr.write(child.stderr.decode(errors='replace'))
+            print('{0:<18} ОШИБКА: {1}'.format(name, error))
+            failed.append(name)
+            continue
+
+        result = {"scenario": name, "commit": commit, "time": time.time(), "scale": args.scale,
+                  "latency": args.latency, "bandwidth": args.bandwidth, "chunk": args.chunk,
+                  "segments": args.segments, "workers": args.workers, "bytes": total_bytes,
+                  "wallTime": round(measured["wallTime"], 3),
+                  "peakRssMb": None if measured["peakRss"] is None else round(measured["peakRss"] / MB, 1),
+                  "throughputMbS": round(measured["downloadBytes"] / MB / measured["wallTime"], 2)}
+
+        print('{0:<18} {1:>9.2f} Мб {2:>8.2f} с {3:>8.2f} Мб/с  peak RSS {4} Мб'.format(
+            name, total_bytes / MB, result["wallTime"], result["throughputMbS"], result["peakRssMb"]))
+        if args.output:
+            with open(args.output, 'a', encoding='utf-8') as file_handle:
+                file_handle.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    if failed:
+        sys.exit('Сценарии завершились с ошибкой: {0}'.format(', '.join(failed)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join as join_path
+
+API_PATH = "/update-platform/programs"
+FILES_PATH = "/files/"
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+def make_archive(path, size, files=1):
+    """Создание синтетического ZIP-архива без сжатия.
+    @param path: полный путь к архиву.
+    @param size: суммарный размер файлов архива в байтах.
+    @param files: количество файлов в архиве (для проверки распаковки множества мелких файлов).
+    @return: словарь {"size": размер архива, "hashSum": контрольная сумма в формате сервиса 1С}.
+    """
+    if not os.path.isfile(path):
+        file_size = max(1, size // files)
+        with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_STORED) as archive:
+            for index in range(files):
+                with archive.open('dir{0}/file{1}.bin'.format(index % 50, index), 'w') as member:
+                    remain = file_size
+                    while remain > 0:
+                        block = os.urandom(min(SEND_BLOCK_SIZE * 16, remain))
+                        member.write(block)
+                        remain -= len(block)
+        os.replace(path + '.tmp', path)
+
+    hasher = hashlib.md5()
+    with open(path, 'rb') as file_handle:
+        for block in iter(lambda: file_handle.read(1024 * 1024), b''):
+            hasher.update(block)
+
+    return {"size": os.path.getsize(path), "hashSum": base64.b64encode(hasher.digest()).decode()}
+
+
+class FakeUpdateService:
+    """Локальная замена сервиса update-api.1c.ru для измерения производительности.
+    Отвечает на запросы update/info и update/, отдает архивы из каталога с поддержкой Range,
+    с заданной задержкой ответа и ограничением скорости на одно соединение.
+    """
+
+    def __init__(self, directory, latency=0.0, bandwidth=0):
+        """
+        @param directory: каталог с синтетическими архивами.
+        @param latency: задержка перед каждым ответом в секундах.
+        @param bandwidth: ограничение скорости отдачи файла на соединение в байтах/с (0 - без ограничения).
+        """
+        self.directory = directory
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.platform = None
+        self.configurations = dict()
+        self.__files = dict()
+        self.__server = None
+
+
+    def add_platform(self, version, size):
+        """Публикация дистрибутива платформы.
+        @param version: номер версии платформы.
+        @param size: размер дистрибутива в байтах.
+        """
+        name = 'platform_{0}.zip'.format(version.replace('.', '_'))
+        self.__files[name] = make_archive(join_path(self.directory, name), size)
+        self.platform = {"version": version, "file": name}
+
+
+    def add_configuration(self, program_name, version, chain, size, files=1):
+        """Публикация новой версии конфигурации с цепочкой обновлений.
+        @param program_name: название конфигурации.
+        @param version: номер новой версии.
+        @param chain: количество элементов цепочки обновлений.
+        @param size: размер архива одного элемента цепочки в байтах.
+        @param files: количество файлов в каждом архиве.
+        """
+        items = []
+        for index in range(chain):
+            name = '{0}_{1}_{2}.zip'.format(program_name, version.replace('.', '_'), index)
+            self.__files[name] = make_archive(join_path(self.directory, name), size, files)
+            items.append({"uin": '{0}-{1}'.format(name, index), "file": name,
+                          "templatePath": '{0}\\{1}_{2}'.format(program_name, version.replace('.', '_'), index)})
+        self.configurations[program_name] = {"version": version, "items": items}
+
+
+    def start(self):
+        """Запуск HTTP-сервера на свободном локальном порту.
+        @return: адрес API для подстановки в ApiConnector.API_URL.
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(service.latency)
+                if self.path.endswith('/update/info'):
+                    self.send_json(service.info(body))
+                elif self.path.endswith('/update/'):
+                    self.send_json(service.update(body, 'http://{0}:{1}'.format(*self.server.server_address)))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                time.sleep(service.latency)
+                name = self.path[len(FILES_PATH):]
+                if not self.path.startswith(FILES_PATH) or name not in service.files():
+                    self.send_error(404)
+                    return
+                service.send_file(self, join_path(service.directory, name))
+
+            def send_json(self, data):
+                text = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return 'http://{0}:{1}{2}'.format(*self.__server.server_address, API_PATH)
+
+
+    def stop(self):
+        """Остановка HTTP-сервера."""
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+
+
+    def files(self):
+        """Опубликованные архивы: {имя файла: {"size": ..., "hashSum": ...}}."""
+        return self.__files
+
+
+    def info(self, body):
+        """Ответ на запрос update/info."""
+        if body["updateType"] == 'NewPlatform':
+            if self.platform is None:
+                return {"platformUpdateResponse": None}
+            name = self.platform["file"]
+            return {"platformUpdateResponse": {"platformVersion": self.platform["version"],
+                                               "distributionUin": name,
+                                               "size": self.__files[name]["size"]}}
+
+        configuration = self.configurations.get(body["programName"])
+        if configuration is None or configuration["version"] == body["versionNumber"]:
+            return {"configurationUpdateResponse": None}
+        return {"configurationUpdateResponse": {"configurationVersion": configuration["version"],
+                                                "upgradeSequence": [item["uin"] for item in configuration["items"]],
+                                                "programVersionUin": body["programName"]}}
+
+
+    def update(self, body, base_url):
+        """Ответ на запрос update/."""
+        if body["platformDistributionUin"] is not None:
+            return {"platformDistributionUrl": base_url + FILES_PATH + body["platformDistributionUin"]}
+
+        configuration = self.configurations[body["programVersionUin"]]
+        for item in configuration["items"]:
+            if item["uin"] == body["upgradeSequence"][0]:
+                file_info = self.__files[item["file"]]
+                return {"configurationUpdateDataList": [{"templatePath": item["templatePath"],
+                                                         "updateFileUrl": base_url + FILES_PATH + item["file"],
+                                                         "updateFileName": "1cv8.cfu",
+                                                         "updateFileFormat": "ZIP",
+                                                         "size": file_info["size"],
+                                                         "hashSum": file_info["hashSum"]}]}
+        return {"configurationUpdateDataList": None}
+
+
+    def send_file(self, handler, path):
+        """Отдача файла (или его диапазона) с ограничением скорости."""
+        file_size = os.path.getsize(path)
+        start, end = 0, file_size - 1
+
+        match = re.match(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                handler.send_response(416)
+                handler.send_header('Content-Range', 'bytes */{0}'.format(file_size))
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, file_size))
+        else:
+            handler.send_response(200)
+        handler.send_header('Content-Length', str(end - start + 1))
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.end_headers()
+
+        started = time.perf_counter()
+        sent = 0
+        with open(path, 'rb') as file_handle:
+            file_handle.seek(start)
+            remain = end - start + 1
+            while remain > 0:
+                block = file_handle.read(min(SEND_BLOCK_SIZE, remain))
+                try:
+                    handler.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remain -= len(block)
+                sent += len(block)
+                if self.bandwidth:
+                    delay = sent / self.bandwidth - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
@@ -1,34 +1,82 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from utils import worker, log, updateapi
+import threading
+from utils import worker, log, daemon, dedup, mirror, verify
 
 def main(argv):
-    """Основная функция выполнения обновления"""
+    """Основная функция выполнения обновления.
+    Ключи запуска:
+        --no-cache - не использовать кэш ответов проверки обновлений;
+        --daemon   - постоянная работа с проверкой обновлений по расписанию (см. utils/daemon.py);
+        --mirror   - только раздача скачанных обновлений другим экземплярам (см. utils/mirror.py);
+        --dedup    - дедупликация ранее распакованных файлов каталогов templatePath и platformPath;
+        --verify   - проверка целостности скачанных архивов (с ключом --full - без учета предыдущих
+                     проверок), поврежденные архивы скачиваются повторно при следующем запуске.
+    """
     print(argv)
 
-    log.init()
-    log.info('Начало проверки обновлений.')
-
     # Инициализация настроек обновления из файла settings.json
     settings_dict = worker.init_settings()
 
-    # Создание коннектора для работы с сервисом проверки обновлений 1С
-    connector = updateapi.ApiConnector(settings_dict["itsUsername"],
-                                       settings_dict["itsPassword"],
-                                       settings_dict["proxySettings"])
+    log_settings = settings_dict.get("logging", dict())
+    log.init(use_queue=log_settings.get("useQueue", True),
+             max_bytes=log_settings.get("maxFileSize", 0) * 1024 * 1024,
+             backup_count=log_settings.get("backupCount", 5),
+             json_lines=log_settings.get("jsonLines", False))
+
+    try:
+        if '--daemon' in argv:
+            log.info('Запуск службы проверки обновлений.')
+            try:
+                daemon.UpdateDaemon(settings_dict).run()
+            except KeyboardInterrupt:
+                pass
+            log.info('Служба проверки обновлений остановлена.')
+            return
+
+        if '--mirror' in argv:
+            mirror_server = mirror.MirrorServer(settings_dict)
+            mirror_server.start()
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+            mirror_server.stop()
+            return
+
+        if '--verify' in argv:
+            with worker.open_state(settings_dict) as state_store:
+                verify.scan(settings_dict, state_store, worker.concurrency_limits(settings_dict)["verifyThreads"],
+                            use_index=not '--full' in argv)
+            return
+
+        if '--dedup' in argv:
+            deduplicator = dedup.FileDeduplicator.from_settings(settings_dict)
+            if deduplicator is None:
+                log.info('Дедупликация не включена в настройке dedup.')
+            else:
+                for directory in (settings_dict["templatePath"], settings_dict["platformPath"]):
+                    report = deduplicator.deduplicate_tree(directory)
+                    log.info('Дедупликация каталога %s: учтено файлов %s, вычислено контрольных сумм %s, '
+                             'заменено ссылками %s, освобождено %.2f Мб.', directory, report["files"],
+                             report["hashed"], report["linked"], report["savedBytes"] / 1024 / 1024)
+                deduplicator.save()
+            return
 
-    # Поиск и скачивание новых версий конфигураций 1С
-    worker.update_configurations(connector, settings_dict)
+        log.info('Начало проверки обновлений.')
 
-    # Поиск и скачивание новой версии платформы 1С
-    worker.update_platform(connector, settings_dict)
+        # Создание коннектора для работы с сервисом проверки обновлений 1С
+        # (кэш ответов сервиса отключается ключом --no-cache)
+        connector = worker.create_connector(settings_dict, use_response_cache=not '--no-cache' in argv)
 
-    # Поиск и скачивание новых версий конфигураций 1С
-    worker.update_configurations(connector, settings_dict)
+        worker.run_update(connector, settings_dict)
+        connector.close()
 
-    log.info('Завершение проверки обновлений.')
-    log.close()
+        log.info('Завершение проверки обновлений.')
+    finally:
+        # Вывод накопленных записей лога и при завершении по исключению
+        log.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from utils import dedup, worker
+
+
+class UnzipOverLinksTest(unittest.TestCase):
+    """Распаковка новой версии в каталог с файлами, связанными жесткими ссылками дедупликации."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='1c_autoupdate_test_')
+        self.deduplicator = dedup.FileDeduplicator(os.path.join(self.work_dir, 'dedup.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def make_zip(self, name, files):
+        path = os.path.join(self.work_dir, name)
+        with zipfile.ZipFile(path, 'w') as upd_zip:
+            for file_name, data in files.items():
+                upd_zip.writestr(file_name, data)
+        return path
+
+    def read(self, name):
+        with open(os.path.join(self.work_dir, name), 'rb') as file_handle:
+            return file_handle.read()
+
+    def test_linked_files_are_not_overwritten(self):
+        old_data = b'1' * 8192
+        new_data = b'2' * 8192
+
+        # Одинаковые файлы первой версии заменяются ссылками на один экземпляр
+        extracted = worker.unzip_unicode(self.make_zip('v1.zip', {'a.dll': old_data, 'b.dll': old_data}))
+        report = self.deduplicator.deduplicate(extracted)
+        self.assertEqual(report["linked"], 1)
+        self.assertTrue(os.path.samefile(os.path.join(self.work_dir, 'a.dll'),
+                                         os.path.join(self.work_dir, 'b.dll')))
+
+        # Новая версия меняет только a.dll
+        worker.unzip_unicode(self.make_zip('v2.zip', {'a.dll': new_data}))
+
+        self.assertEqual(self.read('a.dll'), new_data)
+        self.assertEqual(self.read('b.dll'), old_data)
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, 'a.dll' + worker.UNZIP_TMP_SUFFIX)))
+
+    def test_manifest_is_written_by_save(self):
+        data = b'3' * 8192
+        manifest_path = os.path.join(self.work_dir, 'dedup.json')
+        extracted = worker.unzip_unicode(self.make_zip('v1.zip', {'a.dll': data, 'b.dll': data}))
+
+        self.deduplicator.deduplicate(extracted)
+        self.assertFalse(os.path.exists(manifest_path))
+        self.deduplicator.save()
+
+        # Следующий запуск берет контрольные суммы из манифеста
+        report = dedup.FileDeduplicator(manifest_path).deduplicate(extracted)
+        self.assertEqual(report["files"], 2)
+        self.assertEqual(report["hashed"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
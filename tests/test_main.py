@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import main
+from benchmarks.server import FakeUpdateService
+from utils import metrics, updateapi
+
+
+class MainSmokeTest(unittest.TestCase):
+    """Полный однократный запуск main.main() на локальной замене сервиса обновлений 1С."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='1c_autoupdate_test_')
+        self.old_cwd = os.getcwd()
+        self.old_api_url = updateapi.ApiConnector.API_URL
+
+        self.service = FakeUpdateService(os.path.join(self.work_dir, 'data'))
+        os.makedirs(self.service.directory)
+        self.service.add_configuration('Test', '1.0.0.2', 2, 64 * 1024)
+        self.service.add_platform('8.3.99.1', 128 * 1024)
+        updateapi.ApiConnector.API_URL = self.service.start()
+
+        os.chdir(self.work_dir)
+        os.makedirs('Template')
+        os.makedirs('Platform')
+        settings = {"templatePath": "Template", "platformPath": "Platform", "statePath": "state.db",
+                    "unzipFiles": True, "itsUsername": "user", "itsPassword": "password", "proxySettings": None,
+                    "logging": {"useQueue": False}, "metrics": {"jsonPath": "metrics.json"},
+                    "platform": {"startVersion": "8.3.0.1", "lastDownloaded": ""},
+                    "configurations": [{"humanName": "Test", "programName": "Test",
+                                        "startVersion": "1.0.0.1", "lastDownloaded": ""}]}
+        with open('settings.json', 'w', encoding='utf-8') as file_handle:
+            json.dump(settings, file_handle)
+        metrics.reset()
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        updateapi.ApiConnector.API_URL = self.old_api_url
+        self.service.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_run(self):
+        main.main(['--no-cache'])
+
+        archives = [os.path.join(root, name) for root, _, names in os.walk('Template') for name in names
+                    if name == '1cv8.zip']
+        self.assertEqual(len(archives), 2)
+        self.assertTrue(os.path.isfile(os.path.join('Platform', '8.3.99.1.zip')))
+
+        with open('metrics.json', 'r', encoding='utf-8') as file_handle:
+            exported = json.load(file_handle)
+        phases = {item["labels"]["phase"] for item in exported["timers"] if item["name"] == 'phase'}
+        self.assertEqual(phases, {'configurations', 'platform', 'repair'})
+
+
+if __name__ == '__main__':
+    unittest.main()
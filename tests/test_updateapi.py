@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.server import FakeUpdateService, FILES_PATH
+from utils import mirror, updateapi
+
+SEGMENT_SIZE = 256 * 1024
+
+
+class ControlledUpdateService(FakeUpdateService):
+    """Локальная замена сервиса 1С с записью запросов Range и имитацией сбоев."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.ranges = []
+        # Не поддерживать Range (отдавать файл целиком)
+        self.ignore_range = False
+        # Заголовки Range, ответ на которые один раз обрывается на середине
+        self.cut_ranges = set()
+
+    def send_file(self, handler, path):
+        requested = handler.headers.get('Range')
+        self.ranges.append(requested)
+        if self.ignore_range:
+            del handler.headers['Range']
+
+        if requested in self.cut_ranges:
+            self.cut_ranges.discard(requested)
+            start, end = [int(value) for value in requested[len('bytes='):].split('-')]
+            with open(path, 'rb') as file_handle:
+                file_handle.seek(start)
+                data = file_handle.read((end - start + 1) // 2)
+            handler.send_response(206)
+            handler.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, os.path.getsize(path)))
+            handler.send_header('Content-Length', str(end - start + 1))
+            handler.end_headers()
+            handler.wfile.write(data)
+            handler.close_connection = True
+            return
+
+        super().send_file(handler, path)
+
+
+class DownloadFileTest(unittest.TestCase):
+    """Докачка файлов: последовательная через <target>.part и по частям с состоянием <target>.part.segments."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='1c_autoupdate_test_')
+        self.service = ControlledUpdateService(os.path.join(self.work_dir, 'data'))
+        os.makedirs(self.service.directory)
+        self.service.add_platform('8.3.99.1', 5 * SEGMENT_SIZE // 2)
+        api_url = self.service.start()
+
+        name = self.service.platform["file"]
+        self.url = api_url.split('/update-platform', 1)[0] + FILES_PATH + name
+        self.size = self.service.files()[name]["size"]
+        self.hash_sum = self.service.files()[name]["hashSum"]
+        with open(os.path.join(self.service.directory, name), 'rb') as file_handle:
+            self.data = file_handle.read()
+
+        self.target = os.path.join(self.work_dir, 'platform.zip')
+        self.part_path = self.target + updateapi.ApiConnector.PART_SUFFIX
+        self.state_path = self.part_path + updateapi.ApiConnector.SEGMENTS_SUFFIX
+        self.connector = updateapi.ApiConnector('user', 'password', None, {"retries": 0})
+
+    def tearDown(self):
+        self.connector.close()
+        self.service.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def download(self, connector=None, **options):
+        options.setdefault('expected_size', self.size)
+        options.setdefault('expected_hash', self.hash_sum)
+        return (connector or self.connector).download_file(self.url, self.target, 64 * 1024, **options)
+
+    def write_segments(self, done):
+        """Состояние скачивания по частям, прерванного после частей done."""
+        with open(self.part_path, 'wb') as file_handle:
+            file_handle.truncate(self.size)
+            for index in done:
+                file_handle.seek(index * SEGMENT_SIZE)
+                file_handle.write(self.data[index * SEGMENT_SIZE:(index + 1) * SEGMENT_SIZE])
+        with open(self.state_path, 'w', encoding='utf-8') as file_handle:
+            json.dump({"size": self.size, "segmentSize": SEGMENT_SIZE, "done": sorted(done)}, file_handle)
+
+    def segment_range(self, index):
+        return 'bytes={0}-{1}'.format(index * SEGMENT_SIZE, min((index + 1) * SEGMENT_SIZE, self.size) - 1)
+
+    def assert_downloaded(self, result):
+        self.assertEqual(result, self.size)
+        with open(self.target, 'rb') as file_handle:
+            self.assertEqual(file_handle.read(), self.data)
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resume_segmented(self):
+        self.write_segments([0, 1])
+
+        self.assert_downloaded(self.download(segments=4, segment_size=SEGMENT_SIZE))
+        self.assertNotIn(self.segment_range(0), self.service.ranges)
+        self.assertNotIn(self.segment_range(1), self.service.ranges)
+        self.assertIn(self.segment_range(2), self.service.ranges)
+
+    def test_interrupted_segmented(self):
+        self.service.cut_ranges.add(self.segment_range(1))
+
+        # Оборванная часть не отмечается скачанной, остальные части сохраняются
+        self.assertIsNone(self.download(segments=4, segment_size=SEGMENT_SIZE, attempts=1))
+        with open(self.state_path, 'r', encoding='utf-8') as file_handle:
+            done = json.load(file_handle)["done"]
+        self.assertEqual(done, [index for index in range(-(-self.size // SEGMENT_SIZE)) if index != 1])
+
+        self.service.ranges.clear()
+        self.assert_downloaded(self.download(segments=4, segment_size=SEGMENT_SIZE))
+        self.assertEqual([item for item in self.service.ranges if item != 'bytes=0-0'], [self.segment_range(1)])
+
+    def test_segmented_hash_mismatch(self):
+        self.write_segments([0, 1])
+        with open(self.part_path, 'r+b') as file_handle:
+            file_handle.write(b'broken')
+
+        # Контрольная сумма проверяется по готовому файлу, поврежденный файл удаляется
+        self.assertIsNone(self.download(segments=4, segment_size=SEGMENT_SIZE, attempts=1))
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertFalse(os.path.exists(self.target))
+
+    def test_resume_part(self):
+        offset = SEGMENT_SIZE + 123
+        with open(self.part_path, 'wb') as file_handle:
+            file_handle.write(self.data[:offset])
+
+        self.assert_downloaded(self.download())
+        self.assertEqual(self.service.ranges, ['bytes={0}-'.format(offset)])
+
+    def test_server_ignores_range(self):
+        self.service.ignore_range = True
+        with open(self.part_path, 'wb') as file_handle:
+            file_handle.write(b'x' * SEGMENT_SIZE)
+
+        # Файл скачивается заново целиком одним потоком
+        self.assert_downloaded(self.download(segments=4, segment_size=SEGMENT_SIZE))
+
+    def test_range_not_satisfiable(self):
+        with open(self.part_path, 'wb') as file_handle:
+            file_handle.write(self.data)
+
+        # Без ожидаемого размера запрашивается диапазон за концом файла, после ответа 416 файл скачивается заново
+        self.assert_downloaded(self.download(expected_size=None, expected_hash=None, attempts=2))
+        self.assertEqual(self.service.ranges, ['bytes={0}-'.format(self.size), None])
+
+    def test_mirror_miss_keeps_segments(self):
+        os.makedirs(os.path.join(self.work_dir, 'mirror'))
+        mirror_server = mirror.MirrorServer({"templatePath": os.path.join(self.work_dir, 'mirror'),
+                                             "platformPath": os.path.join(self.work_dir, 'mirror'),
+                                             "statePath": os.path.join(self.work_dir, 'state.db'),
+                                             "mirror": {"listenHost": "127.0.0.1"}})
+        connector = updateapi.ApiConnector('user', 'password', None, {"retries": 0}, mirror_url=mirror_server.start())
+        try:
+            self.write_segments([0, 1])
+            self.assert_downloaded(self.download(connector, segments=4, segment_size=SEGMENT_SIZE,
+                                                 mirror_path=mirror.file_path(mirror.PLATFORM_PREFIX, 'platform.zip')))
+        finally:
+            connector.close()
+            mirror_server.stop()
+        self.assertNotIn(self.segment_range(0), self.service.ranges)
+        self.assertNotIn(self.segment_range(1), self.service.ranges)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from os.path import join as join_path
+from utils import log, metrics
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def new_hash():
+    """Объект вычисления контрольной суммы в формате поля hashSum сервиса 1С (MD5)."""
+    return hashlib.md5()
+
+
+def hash_sum(hasher):
+    """Значение контрольной суммы в формате поля hashSum сервиса 1С (base64).
+    @param hasher: объект, полученный из new_hash().
+    """
+    return base64.b64encode(hasher.digest()).decode()
+
+
+def file_hash(path, hasher=None, length=None):
+    """Вычисление контрольной суммы файла (или его начала).
+    @param path: полный путь к файлу.
+    @param hasher: объект из new_hash(), который дополняется данными файла.
+    @param length: количество байт от начала файла (по умолчанию весь файл).
+    @return: объект hasher.
+    """
+    if hasher is None:
+        hasher = new_hash()
+
+    with metrics.timer('hash'), open(path, 'rb') as file_handle:
+        remain = length
+        while remain is None or remain > 0:
+            block = file_handle.read(HASH_BLOCK_SIZE if remain is None else min(HASH_BLOCK_SIZE, remain))
+            if not block:
+                break
+            hasher.update(block)
+            if remain is not None:
+                remain -= len(block)
+
+    return hasher
+
+
+def mapped_file_hash(path, hasher=None):
+    """Вычисление контрольной суммы файла целиком через отображение файла в память.
+    Данные не копируются в буферы Python, а вычисление выполняется без удержания GIL,
+    поэтому несколько файлов можно хешировать параллельно в потоках.
+    @param path: полный путь к файлу.
+    @param hasher: объект из new_hash(), который дополняется данными файла.
+    @return: объект hasher.
+    """
+    if hasher is None:
+        hasher = new_hash()
+
+    with metrics.timer('hash'), open(path, 'rb') as file_handle:
+        if os.fstat(file_handle.fileno()).st_size > 0:
+            with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+
+    return hasher
+
+
+class DownloadCache:
+    """Локальный кэш скачанных архивов, адресуемый по контрольной сумме hashSum.
+    Архивы хранятся в каталоге кэша под именем, вычисленным из hashSum, и помещаются
+    в каталог назначения жесткой ссылкой (или копированием, если ссылка невозможна).
+    Сведения о проверенных архивах хранятся в файле index.json каталога кэша; перед каждой
+    записью индекс объединяется с записями других процессов (пересекающихся запусков).
+    Архив в кэше и размещенные из него файлы - один и тот же файл на диске, поэтому при
+    добавлении запоминаются его размер и время изменения; если они изменились, перед
+    выдачей из кэша контрольная сумма архива проверяется заново.
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, directory=None):
+        """
+        @param directory: каталог кэша; если не задан, кэширование отключено.
+        """
+        self.__directory = directory if directory else None
+        self.__index = dict()
+        # Контрольные суммы архивов, удаленных из кэша этим процессом
+        self.__removed = set()
+        self.__index_lock = threading.Lock()
+        self.__hash_locks = dict()
+
+        if self.__directory is not None:
+            os.makedirs(self.__directory, exist_ok=True)
+            self.__index = self.__read_index()
+
+
+    def lock(self, hash_value):
+        """Блокировка для обработки архива с указанной контрольной суммой в одном потоке.
+        @param hash_value: контрольная сумма архива (hashSum).
+        @return: объект threading.Lock.
+        """
+        with self.__index_lock:
+            return self.__hash_locks.setdefault(hash_value, threading.Lock())
+
+
+    def fetch(self, hash_value, size, target):
+        """Размещение архива из кэша по указанному пути.
+        @param hash_value: контрольная сумма архива (hashSum).
+        @param size: ожидаемый размер архива в байтах.
+        @param target: полный путь, по которому нужно разместить архив.
+        @return: True, если архив найден в кэше и размещен.
+        """
+        if self.__directory is None:
+            return False
+
+        with self.__index_lock:
+            entry = self.__index.get(hash_value)
+        if entry is None:
+            return False
+
+        blob_path = join_path(self.__directory, entry["path"])
+        if entry["size"] != size or not os.path.isfile(blob_path) or os.path.getsize(blob_path) != size:
+            self.__forget(hash_value)
+            return False
+
+        mtime = os.stat(blob_path).st_mtime_ns
+        if entry.get("mtime") != mtime:
+            # Архив изменялся после добавления в кэш (например, через размещенную жесткую ссылку)
+            if hash_sum(file_hash(blob_path)) != hash_value:
+                log.warn('Архив %s в кэше поврежден и будет удален.', blob_path)
+                self.discard(hash_value)
+                return False
+            with self.__index_lock:
+                entry["mtime"] = mtime
+                self.__save_index()
+
+        if os.path.isfile(target) and os.path.samefile(blob_path, target):
+            return True
+
+        self.__place(blob_path, target)
+        return True
+
+
+    def add(self, hash_value, size, path):
+        """Добавление проверенного архива в кэш.
+        @param hash_value: контрольная сумма архива (hashSum).
+        @param size: размер архива в байтах.
+        @param path: полный путь к скачанному архиву.
+        """
+        if self.__directory is None:
+            return
+
+        relative_path = join_path(self.__blob_name(hash_value)[:2], self.__blob_name(hash_value))
+        blob_path = join_path(self.__directory, relative_path)
+        with self.__index_lock:
+            entry = self.__index.get(hash_value)
+
+        # Имеющийся архив сохраняется, только если он не изменялся после проверки,
+        # иначе он заменяется только что проверенным
+        if not (os.path.isfile(blob_path) and entry is not None and entry["size"] == size
+                and os.path.getsize(blob_path) == size and entry.get("mtime") == os.stat(blob_path).st_mtime_ns):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            self.__place(path, blob_path)
+
+        with self.__index_lock:
+            self.__index[hash_value] = {"path": relative_path, "size": size,
+                                        "mtime": os.stat(blob_path).st_mtime_ns}
+            self.__removed.discard(hash_value)
+            self.__save_index()
+
+
+    def discard(self, hash_value):
+        """Удаление архива из кэша (например, поврежденного на диске).
+        @param hash_value: контрольная сумма архива (hashSum).
+        """
+        if self.__directory is None:
+            return
+
+        blob_path = join_path(self.__directory, self.__blob_name(hash_value)[:2], self.__blob_name(hash_value))
+        self.__forget(hash_value)
+        if os.path.isfile(blob_path):
+            os.remove(blob_path)
+
+
+    def __forget(self, hash_value):
+        """Удаление записи об архиве из индекса кэша."""
+        with self.__index_lock:
+            self.__removed.add(hash_value)
+            if self.__index.pop(hash_value, None) is not None:
+                self.__save_index()
+
+
+    def __read_index(self):
+        """Чтение индекса кэша с диска.
+        @return: словарь {hashSum: {"path", "size", "mtime"}}.
+        """
+        index_path = join_path(self.__directory, self.INDEX_NAME)
+        if not os.path.isfile(index_path):
+            return dict()
+
+        try:
+            with open(index_path, 'r', encoding='utf-8') as file_handle:
+                return json.load(file_handle)
+        except ValueError as ex:
+            log.error('Ошибка чтения индекса кэша скачанных файлов. %s', ex)
+            return dict()
+
+
+    def __save_index(self):
+        """Атомарная запись индекса кэша (вызывается под блокировкой индекса).
+        Записи, добавленные другими процессами после чтения индекса, сохраняются.
+        """
+        for hash_value, entry in self.__read_index().items():
+            if hash_value not in self.__index and hash_value not in self.__removed:
+                self.__index[hash_value] = entry
+
+        index_path = join_path(self.__directory, self.INDEX_NAME)
+        tmp_path = '{0}.{1}.tmp'.format(index_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+            json.dump(self.__index, file_handle, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+
+
+    @staticmethod
+    def __blob_name(hash_value):
+        """Имя файла архива в кэше: hashSum в шестнадцатеричном виде."""
+        return base64.b64decode(hash_value).hex() + '.zip'
+
+
+    @staticmethod
+    def __place(source, target):
+        """Размещение файла жесткой ссылкой или копированием."""
+        tmp_path = '{0}.{1}.tmp'.format(target, os.getpid())
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+
+
+class ResponseCache:
+    """Сохраняемый на диск кэш ответов сервиса проверки обновлений 1С.
+    Записи устаревают через ttl секунд, при превышении max_entries вытесняются
+    записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=1000):
+        """
+        @param path: полный путь к файлу кэша.
+        @param ttl: время жизни записи в секундах.
+        @param max_entries: максимальное количество записей.
+        """
+        from collections import OrderedDict
+
+        self.__path = path
+        self.__ttl = ttl
+        self.__max_entries = max(1, max_entries)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file_handle:
+                    for key, entry in json.load(file_handle):
+                        self.__entries[key] = entry
+            except ValueError as ex:
+                log.error('Ошибка чтения кэша ответов сервиса обновлений. %s', ex)
+
+
+    @staticmethod
+    def key(program_name, version, update_type):
+        """Ключ записи кэша.
+        @param program_name: название конфигурации (programName).
+        @param version: проверяемая версия.
+        @param update_type: тип обновления (updateType).
+        """
+        return '{0}|{1}|{2}'.format(program_name, version, update_type)
+
+
+    def get(self, key):
+        """Получение сохраненного ответа.
+        @param key: ключ записи, см. key().
+        @return: ответ сервиса или None, если записи нет или она устарела.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["time"] > self.__ttl:
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+            return entry["value"]
+
+
+    def put(self, key, value):
+        """Сохранение ответа сервиса.
+        @param key: ключ записи, см. key().
+        @param value: ответ сервиса (None не сохраняется).
+        """
+        if value is None:
+            return
+
+        with self.__lock:
+            self.__entries[key] = {"time": time.time(), "value": value}
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+            self.__save()
+
+
+    def clear(self):
+        """Удаление всех записей кэша."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__save()
+
+
+    def __save(self):
+        """Атомарная запись кэша на диск (вызывается под блокировкой)."""
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = '{0}.{1}.tmp'.format(self.__path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+            json.dump(list(self.__entries.items()), file_handle, ensure_ascii=False)
+        os.replace(tmp_path, self.__path)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import log, metrics, mirror, worker
+
+SETTINGS_PATH = "settings.json"
+# Период проверки изменения settings.json, секунд
+SETTINGS_CHECK_PERIOD = 5
+
+
+class UpdateDaemon:
+    """Постоянно работающая служба проверки обновлений.
+    Коннектор к сервису 1С и его пул соединений создаются один раз и используются во всех
+    циклах проверки. При изменении settings.json настройки перечитываются перед следующим
+    циклом, коннектор пересоздается только при изменении параметров подключения.
+    Кэш ответов проверки обновлений не используется, чтобы новые релизы обнаруживались
+    в течение одного периода проверки.
+
+    Локальный HTTP-интерфейс управления:
+        GET  /status  - состояние службы и показатели последнего цикла;
+        POST /trigger - внеочередная проверка обновлений;
+        POST /pause   - приостановка проверок по расписанию;
+        POST /resume  - возобновление проверок по расписанию.
+    Если задан порт mirror.listenPort, вместе со службой запускается зеркало обновлений
+    для других экземпляров в локальной сети (см. utils/mirror.py).
+    """
+
+    # Настройки, при изменении которых коннектор создается заново
+    CONNECTOR_KEYS = ("itsUsername", "itsPassword", "proxySettings", "connection", "bandwidthLimit", "mirror")
+
+    def __init__(self, settings):
+        """
+        @param settings: настройки обновления в виде словаря, параметры службы задаются блоком daemon:
+                         {
+                             "interval": 15,              - период проверки обновлений в минутах
+                             "jitter": 0.1,               - случайное отклонение периода (доля от interval)
+                             "controlHost": "127.0.0.1",  - адрес интерфейса управления
+                             "controlPort": 8765          - порт интерфейса управления (0 - отключен)
+                         }
+                         Адрес и порт интерфейса управления применяются только при запуске службы.
+        """
+        self.__settings = settings
+        self.__settings_mtime = self.__mtime()
+        self.__connector = None
+        self.__server = None
+        self.__mirror = None
+
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stopping = False
+        self.__paused = False
+        self.__triggered = False
+        self.__status = {"state": "idle", "runs": 0, "lastStart": None, "lastFinish": None,
+                         "lastDuration": None, "lastError": None, "nextRun": None, "settingsLoaded": time.time()}
+
+
+    def run(self):
+        """Цикл работы службы; выполняется до вызова stop() или прерывания процесса."""
+        self.__start_control()
+        if self.__settings.get("mirror", dict()).get("listenPort"):
+            self.__mirror = mirror.MirrorServer(self.__settings)
+            self.__mirror.start()
+        next_run = time.time()
+        try:
+            while not self.__stopping:
+                self.__reload_settings()
+
+                with self.__lock:
+                    due = self.__triggered or (not self.__paused and time.time() >= next_run)
+                    self.__triggered = False
+                    self.__status["nextRun"] = None if self.__paused else next_run
+
+                if due:
+                    self.__run_cycle()
+                    next_run = time.time() + self.__next_delay()
+                    continue
+
+                self.__wakeup.wait(max(0, min(SETTINGS_CHECK_PERIOD, next_run - time.time())))
+                self.__wakeup.clear()
+        finally:
+            if self.__server is not None:
+                self.__server.shutdown()
+                self.__server.server_close()
+            if self.__mirror is not None:
+                self.__mirror.stop()
+            if self.__connector is not None:
+                self.__connector.close()
+
+
+    def stop(self):
+        """Остановка службы после завершения текущего цикла проверки."""
+        self.__stopping = True
+        self.__wakeup.set()
+
+
+    def trigger(self):
+        """Внеочередная проверка обновлений (выполняется и при приостановленном расписании)."""
+        with self.__lock:
+            self.__triggered = True
+        self.__wakeup.set()
+
+
+    def pause(self):
+        """Приостановка проверок по расписанию; текущий цикл проверки не прерывается."""
+        with self.__lock:
+            self.__paused = True
+            if self.__status["state"] != "running":
+                self.__status["state"] = "paused"
+        log.info('Проверки обновлений по расписанию приостановлены.')
+
+
+    def resume(self):
+        """Возобновление проверок по расписанию."""
+        with self.__lock:
+            self.__paused = False
+            if self.__status["state"] == "paused":
+                self.__status["state"] = "idle"
+        self.__wakeup.set()
+        log.info('Проверки обновлений по расписанию возобновлены.')
+
+
+    def status(self):
+        """Состояние службы.
+        @return: словарь с состоянием (idle, running, paused), временем последнего и следующего
+                 цикла проверки, последней ошибкой и показателями последнего цикла.
+        """
+        with self.__lock:
+            result = dict(self.__status)
+        result["metrics"] = metrics.snapshot()
+        return result
+
+
+    def __run_cycle(self):
+        """Один цикл проверки и скачивания обновлений на общем коннекторе."""
+        if self.__connector is None:
+            self.__connector = worker.create_connector(self.__settings, use_response_cache=False)
+
+        with self.__lock:
+            self.__status.update(state="running", lastStart=time.time())
+
+        log.info('Начало проверки обновлений.')
+        metrics.reset()
+        error = None
+        try:
+            worker.run_update(self.__connector, self.__settings)
+        except Exception as ex:
+            error = str(ex)
+            log.error('Ошибка при проверке обновлений. %s', ex)
+        log.info('Завершение проверки обновлений.')
+
+        with self.__lock:
+            finished = time.time()
+            self.__status.update(state="paused" if self.__paused else "idle", lastFinish=finished,
+                                 lastDuration=finished - self.__status["lastStart"], lastError=error,
+                                 runs=self.__status["runs"] + 1)
+
+
+    def __next_delay(self):
+        """Задержка до следующего цикла проверки с учетом случайного отклонения, секунд."""
+        daemon_settings = self.__settings.get("daemon", dict())
+        interval = daemon_settings.get("interval", 15) * 60
+        jitter = daemon_settings.get("jitter", 0.1)
+        return max(SETTINGS_CHECK_PERIOD, interval * (1 + random.uniform(-jitter, jitter)))
+
+
+    def __reload_settings(self):
+        """Перечитывание settings.json, если файл изменился с момента последнего чтения."""
+        mtime = self.__mtime()
+        if mtime == self.__settings_mtime:
+            return
+        self.__settings_mtime = mtime
+
+        try:
+            settings = worker.init_settings()
+        except (OSError, ValueError) as ex:
+            # Файл может быть сохранен не полностью - повторная попытка при следующем изменении
+            log.error('Не удалось перечитать настройки из файла settings.json. %s', ex)
+            return
+
+        if self.__connector is not None and \
+                any(settings.get(key) != self.__settings.get(key) for key in self.CONNECTOR_KEYS):
+            self.__connector.close()
+            self.__connector = None
+
+        self.__settings = settings
+        with self.__lock:
+            self.__status["settingsLoaded"] = time.time()
+        log.info('Настройки из файла settings.json перечитаны.')
+
+
+    def __start_control(self):
+        """Запуск HTTP-интерфейса управления службой в фоновом потоке."""
+        daemon_settings = self.__settings.get("daemon", dict())
+        port = daemon_settings.get("controlPort", 0)
+        if not port:
+            return
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/status':
+                    self.send_json(200, service.status())
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                actions = {'/trigger': service.trigger, '/pause': service.pause, '/resume': service.resume}
+                action = actions.get(self.path)
+                if action is None:
+                    self.send_json(404, {"error": "not found"})
+                    return
+                action()
+                self.send_json(200, service.status())
+
+            def send_json(self, code, data):
+                text = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+        host = daemon_settings.get("controlHost", "127.0.0.1")
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, name='daemon-control', daemon=True).start()
+        log.info('Интерфейс управления службой: http://%s:%s/status', host, port)
+
+
+    @staticmethod
+    def __mtime():
+        """Время изменения файла settings.json (None, если файл недоступен)."""
+        try:
+            return os.stat(SETTINGS_PATH).st_mtime_ns
+        except OSError:
+            return None
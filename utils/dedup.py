@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+from os.path import join as join_path
+from utils import cache, log, metrics
+
+# Файлы, не участвующие в дедупликации каталога (архивы дедуплицируются кэшем скачивания)
+SKIP_SUFFIXES = (".zip", ".part", ".segments", ".tmp")
+LINK_SUFFIX = ".dedup.tmp"
+
+
+class FileDeduplicator:
+    """Дедупликация распакованных файлов обновлений жесткими ссылками.
+    Одинаковые по содержимому файлы разных версий заменяются жесткими ссылками на один
+    экземпляр, поэтому место на диске растет только на изменившиеся между релизами файлы.
+    Контрольные суммы файлов хранятся в файле-манифесте вместе с размером и временем
+    изменения; файлы, не изменившиеся с момента последнего учета, повторно не хешируются.
+    Связанные файлы имеют общее содержимое, поэтому изменять распакованные файлы
+    на месте нельзя (замена файла целиком связь разрывает).
+    Манифест читается при создании объекта и записывается вызовом save(), поэтому объект
+    создается один раз на запуск и используется для всех распаковываемых архивов.
+    """
+
+    def __init__(self, manifest_path, min_size=0):
+        """
+        @param manifest_path: полный путь к файлу-манифесту.
+        @param min_size: минимальный размер файла в байтах, участвующего в дедупликации.
+        """
+        self.__path = manifest_path
+        self.__min_size = min_size
+        self.__lock = threading.Lock()
+        # {путь: [размер, время изменения (нс), контрольная сумма]}
+        self.__files = dict()
+        # {(размер, контрольная сумма): путь к экземпляру, на который ссылаются остальные файлы}
+        self.__contents = dict()
+        self.__changed = False
+        self.__load()
+
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Создание объекта дедупликации по настройке dedup:
+           {
+               "enabled": true,
+               "manifestPath": "cache\\\\dedup.json",
+               "minSize": 4                              - минимальный размер файла в Кб
+           }
+        @param settings: настройки обновления в виде словаря.
+        @return: объект FileDeduplicator или None, если дедупликация не включена.
+        """
+        dedup_settings = settings.get("dedup")
+        if not dedup_settings or not dedup_settings.get("enabled", True):
+            return None
+        return cls(dedup_settings.get("manifestPath", "dedup.json"), int(dedup_settings.get("minSize", 4) * 1024))
+
+
+    def deduplicate(self, paths):
+        """Учет файлов и замена повторяющихся жесткими ссылками.
+        @param paths: полные пути к файлам (например, распакованным из архива).
+        @return: отчет в виде словаря {"files": учтено файлов, "hashed": вычислено контрольных сумм,
+                 "linked": заменено ссылками, "savedBytes": освобождено байт}.
+        """
+        report = {"files": 0, "hashed": 0, "linked": 0, "savedBytes": 0}
+        with metrics.timer('dedup'):
+            for path in paths:
+                try:
+                    self.__process(os.path.abspath(path), report)
+                except OSError as ex:
+                    log.error('Ошибка дедупликации файла %s. %s', path, ex)
+
+        metrics.add('dedup_files', report["files"])
+        metrics.add('dedup_linked_files', report["linked"])
+        metrics.add('dedup_saved_bytes', report["savedBytes"])
+        return report
+
+
+    def deduplicate_tree(self, directory):
+        """Дедупликация всех файлов каталога (например, ранее распакованных версий в templatePath).
+        @param directory: полный путь к каталогу.
+        @return: отчет, см. deduplicate().
+        """
+        paths = [join_path(root, name) for root, _, names in os.walk(directory)
+                 for name in names if not name.lower().endswith(SKIP_SUFFIXES)]
+        return self.deduplicate(paths)
+
+
+    def save(self):
+        """Запись манифеста на диск, если учтены новые или измененные файлы."""
+        with self.__lock:
+            if self.__changed:
+                self.__save()
+                self.__changed = False
+
+
+    def __process(self, path, report):
+        """Учет одного файла; при наличии такого же содержимого файл заменяется жесткой ссылкой."""
+        stat = os.stat(path)
+        if stat.st_size < self.__min_size:
+            return
+        report["files"] += 1
+
+        with self.__lock:
+            known = self.__files.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = cache.file_hash(path, hashlib.sha256()).hexdigest()
+            report["hashed"] += 1
+
+        key = (stat.st_size, digest)
+        with self.__lock:
+            canonical = self.__contents.get(key)
+            if canonical is None or canonical == path or not self.__is_current(canonical):
+                self.__contents[key] = path
+                self.__files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+                self.__changed = True
+                return
+
+        canonical_stat = os.stat(canonical)
+        if not os.path.samestat(canonical_stat, stat):
+            # Ссылка создается под временным именем и атомарно заменяет файл
+            link_path = path + LINK_SUFFIX
+            try:
+                os.link(canonical, link_path)
+                os.replace(link_path, path)
+            except OSError as ex:
+                # Другой том, превышено количество ссылок и т.п. - файл становится новым экземпляром
+                if os.path.isfile(link_path):
+                    os.remove(link_path)
+                log.debug('Не удалось заменить файл %s ссылкой на %s. %s', path, canonical, ex)
+                with self.__lock:
+                    self.__contents[key] = path
+                    self.__files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+                self.__changed = True
+                return
+            report["linked"] += 1
+            report["savedBytes"] += stat.st_size
+
+        with self.__lock:
+            self.__files[path] = [canonical_stat.st_size, canonical_stat.st_mtime_ns, digest]
+            self.__changed = True
+
+
+    def __is_current(self, path):
+        """Проверка, что файл не изменялся с момента учета (вызывается под блокировкой)."""
+        known = self.__files.get(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if known is None or stat is None or known[0] != stat.st_size or known[1] != stat.st_mtime_ns:
+            self.__files.pop(path, None)
+            self.__changed = True
+            return False
+        return True
+
+
+    def __load(self):
+        """Чтение манифеста; записи об удаленных и измененных файлах отбрасываются."""
+        if not os.path.isfile(self.__path):
+            return
+
+        try:
+            with open(self.__path, 'r', encoding='utf-8') as file_handle:
+                files = json.load(file_handle)["files"]
+        except (ValueError, KeyError) as ex:
+            log.warn('Манифест дедупликации %s поврежден и будет создан заново. %s', self.__path, ex)
+            return
+
+        for path, (size, mtime, digest) in files.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_size == size and stat.st_mtime_ns == mtime:
+                self.__files[path] = [size, mtime, digest]
+                self.__contents.setdefault((size, digest), path)
+        self.__changed = len(self.__files) != len(files)
+
+
+    def __save(self):
+        """Атомарная запись манифеста на диск (вызывается под блокировкой)."""
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = '{0}.{1}.tmp'.format(self.__path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+            json.dump({"files": self.__files}, file_handle, ensure_ascii=False)
+        os.replace(tmp_path, self.__path)
@@ -1,6 +1,12 @@
 ﻿# -*- coding: utf-8 -*-
 
+import atexit
+import getpass
+import json
 import logging
+import logging.handlers
+import queue
+import sys
 import traceback
 import os
 from os import getlogin, makedirs as make_dir
@@ -8,44 +14,112 @@ from os.path import exists, join as join_path
 from platform import node as comp_name
 
 __logger_on = False
+__listener = None
+__atexit_registered = False
 __LOGGER = logging.getLogger('assembly')
-__ENV_DESC = {'user': getlogin(), 'comp': comp_name()}
 
-def init(print_to_console=True, print_to_file=True):
-    """Инициализация объекта логирования"""
-    global __logger_on
+
+def user_name():
+    """Возвращает имя пользователя, от имени которого запущен процесс"""
+    try:
+        return getlogin()
+    except OSError:
+        # Процесс без управляющего терминала (служба, планировщик, CI)
+        return getpass.getuser()
+
+
+__ENV_DESC = {'user': user_name(), 'comp': comp_name()}
+
+# Количество записей стека, выводимых при вызове error() вне обработки исключения
+TRACE_DEPTH = 6
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Форматирование записей лога в виде JSON-строк (одна запись - одна строка)."""
+
+    def format(self, record):
+        return json.dumps({'time': self.formatTime(record),
+                           'level': record.levelname,
+                           'comp': getattr(record, 'comp', ''),
+                           'user': getattr(record, 'user', ''),
+                           'thread': record.threadName,
+                           'message': record.getMessage()}, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Передача записей лога в очередь без форматирования в вызывающем потоке.
+    Сообщение собирается из шаблона и аргументов уже в фоновом потоке вывода."""
+
+    def prepare(self, record):
+        return record
+
+
+def init(print_to_console=True, print_to_file=True, use_queue=True, max_bytes=0, backup_count=5, json_lines=False):
+    """Инициализация объекта логирования
+    @param print_to_console: выводить записи в консоль.
+    @param print_to_file: выводить записи в файл logs/main.log.
+    @param use_queue: передавать записи в фоновый поток, который выполняет весь вывод,
+                      чтобы вызывающие потоки не ожидали записи на диск и в консоль.
+    @param max_bytes: размер файла лога в байтах, после которого он переименовывается
+                      в main.log.1 и т.д. (0 - без ограничения).
+    @param backup_count: количество хранимых старых файлов лога.
+    @param json_lines: записывать файл лога в формате JSON-строк.
+    """
+    global __logger_on, __listener, __atexit_registered
 
     log_level = logging.DEBUG
     __LOGGER.setLevel(log_level)
     __logger_on = True
 
     formatter = logging.Formatter('%(asctime)s %(comp)s(%(user)s)- %(levelname)s: %(message)s')
+    handlers = []
 
     # Вывод данных логирования в файл
     if print_to_file:
-        file_handle = logging.FileHandler(file_name(), 'a', 'utf-8')
+        file_handle = logging.handlers.RotatingFileHandler(file_name(), 'a', max_bytes, backup_count, 'utf-8')
         file_handle.setLevel(log_level)
-        file_handle.setFormatter(formatter)
-        __LOGGER.addHandler(file_handle)
+        file_handle.setFormatter(JsonLinesFormatter() if json_lines else formatter)
+        handlers.append(file_handle)
 
     if print_to_console:
         # Вывод данных логирования в консоль
         console_handle = logging.StreamHandler()
         console_handle.setLevel(log_level)
         console_handle.setFormatter(formatter)
-        __LOGGER.addHandler(console_handle)
+        handlers.append(console_handle)
+
+    if use_queue and handlers:
+        # Вывод выполняется фоновым потоком, вызывающий поток только помещает запись в очередь
+        log_queue = queue.SimpleQueue()
+        __LOGGER.addHandler(DeferredQueueHandler(log_queue))
+        __listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        __listener.start()
+    else:
+        for handle in handlers:
+            __LOGGER.addHandler(handle)
+
+    # Поток вывода фоновый, поэтому при аварийном завершении процесса накопленные записи
+    # выводятся при выходе из интерпретатора
+    if not __atexit_registered:
+        atexit.register(close)
+        __atexit_registered = True
 
 
 def close():
-    global __logger_on
+    global __logger_on, __listener
+
+    # Остановка фонового потока с выводом всех накопленных записей
+    handlers = list(__LOGGER.handlers)
+    if __listener is not None:
+        __listener.stop()
+        handlers += list(__listener.handlers)
+        __listener = None
 
-    if __LOGGER.hasHandlers():
-        for handle in __LOGGER.handlers:
-            if isinstance(handle, logging.FileHandler):
-                handle.close()
-            elif isinstance(handle, logging.StreamHandler):
-                handle.flush()
-                __LOGGER.removeHandler(handle)
+    for handle in handlers:
+        if isinstance(handle, logging.StreamHandler):
+            handle.flush()
+        handle.close()
+        __LOGGER.removeHandler(handle)
 
     __logger_on = False
 
@@ -56,7 +130,7 @@ def info(msg, *args):
     if __logger_on:
         __LOGGER.info(msg, *args, extra=__ENV_DESC)
     else:
-        print(msg)
+        print(msg % args if args else msg)
 
 
 def warn(msg, *args):
@@ -65,7 +139,7 @@ def warn(msg, *args):
     if __logger_on:
         __LOGGER.warning(msg, *args, extra=__ENV_DESC)
     else:
-        print(msg)
+        print(msg % args if args else msg)
 
 def debug(msg, *args):
     global __logger_on
@@ -73,23 +147,23 @@ def debug(msg, *args):
     if __logger_on:
         __LOGGER.debug(msg, *args, extra=__ENV_DESC)
     else:
-        print(msg)
+        print(msg % args if args else msg)
 
 def error(msg, *args):
     global __logger_on
 
-    trace = traceback.format_exc()
-    if not trace or trace is None or trace == 'NoneType\n':
-        # Если исключения не было, то фиксируем место откуда был вызов функции
-        trace = traceback.format_stack()
-        trace = '\n'.join([trace[x] for x in range(0, len(trace)) if x >= len(trace) - 6]) # Только последние шесть записей
-
-    full_msg = msg + "\n\tTRACE:\n" + trace
+    if not __logger_on:
+        print(msg % args if args else msg)
+        return
 
-    if __logger_on:
-        __LOGGER.error(full_msg, *args, extra=__ENV_DESC)
+    if sys.exc_info()[0] is not None:
+        trace = traceback.format_exc()
     else:
-        print(msg)
+        # Если исключения не было, то фиксируем место откуда был вызов функции
+        trace = ''.join(traceback.format_stack(limit=TRACE_DEPTH + 1)[:-1]) # Только последние шесть записей
+
+    # Трассировка передается аргументом, чтобы символы % в ней не участвовали в форматировании
+    __LOGGER.error(msg + "\n\tTRACE:\n%s", *args, trace, extra=__ENV_DESC)
 
 
 def directory():
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from utils import log
+
+PROMETHEUS_PREFIX = "autoupdate_1c"
+
+__LOCK = threading.Lock()
+__TIMERS = dict()
+__COUNTERS = dict()
+
+
+def __key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def reset():
+    """Сброс всех накопленных показателей."""
+    with __LOCK:
+        __TIMERS.clear()
+        __COUNTERS.clear()
+
+
+def add_time(name, seconds, **labels):
+    """Учет длительности операции.
+    @param name: наименование таймера (api_call, download, write, hash, extract и т.д.).
+    @param seconds: длительность в секундах.
+    @param labels: дополнительные признаки (например, method="update/info").
+    """
+    key = __key(name, labels)
+    with __LOCK:
+        item = __TIMERS.get(key)
+        if item is None:
+            item = __TIMERS[key] = {"count": 0, "seconds": 0.0, "max": 0.0}
+        item["count"] += 1
+        item["seconds"] += seconds
+        item["max"] = max(item["max"], seconds)
+
+
+def add(name, value=1, **labels):
+    """Увеличение счетчика.
+    @param name: наименование счетчика (download_bytes, extract_files и т.д.).
+    @param value: величина увеличения.
+    @param labels: дополнительные признаки.
+    """
+    key = __key(name, labels)
+    with __LOCK:
+        __COUNTERS[key] = __COUNTERS.get(key, 0) + value
+
+
+@contextmanager
+def timer(name, **labels):
+    """Контекстный менеджер для учета длительности выполнения блока кода.
+    @param name: наименование таймера.
+    @param labels: дополнительные признаки.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - started, **labels)
+
+
+def snapshot():
+    """Текущие значения показателей.
+    @return: словарь {"timers": [...], "counters": [...]}.
+    """
+    with __LOCK:
+        timers = [dict(name=name, labels=dict(labels), **item) for (name, labels), item in __TIMERS.items()]
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in __COUNTERS.items()]
+    return {"time": time.time(), "timers": timers, "counters": counters}
+
+
+def summary():
+    """Вывод в лог итогов запуска: длительности этапов и скорости скачивания и распаковки."""
+    data = snapshot()
+
+    log.info('Итоги запуска:')
+    for item in sorted(data["timers"], key=lambda value: (value["name"], sorted(value["labels"].items()))):
+        labels = ', '.join('{0}={1}'.format(key, value) for key, value in sorted(item["labels"].items()))
+        log.info(' -- %s%s: %s раз, всего %.2f с, максимум %.2f с.', item["name"],
+                 ' (' + labels + ')' if labels else '', item["count"], item["seconds"], item["max"])
+
+    def total(values, name):
+        return sum(value[name] for value in values)
+
+    download_bytes = total([item for item in data["counters"] if item["name"] == "download_bytes"], "value")
+    download_seconds = total([item for item in data["timers"] if item["name"] == "download"], "seconds")
+    if download_bytes and download_seconds:
+        log.info(' -- Скачано %.2f Мб, средняя скорость %.2f Мб/с.',
+                 download_bytes / 1024 / 1024, download_bytes / 1024 / 1024 / download_seconds)
+
+    extract_bytes = total([item for item in data["counters"] if item["name"] == "extract_bytes"], "value")
+    extract_seconds = total([item for item in data["timers"] if item["name"] == "extract"], "seconds")
+    if extract_bytes and extract_seconds:
+        log.info(' -- Распаковано %.2f Мб, средняя скорость %.2f Мб/с.',
+                 extract_bytes / 1024 / 1024, extract_bytes / 1024 / 1024 / extract_seconds)
+
+    dedup_bytes = total([item for item in data["counters"] if item["name"] == "dedup_saved_bytes"], "value")
+    if dedup_bytes:
+        log.info(' -- Дедупликацией распакованных файлов освобождено %.2f Мб.', dedup_bytes / 1024 / 1024)
+
+
+def export_json(path):
+    """Запись показателей в файл JSON.
+    @param path: полный путь к файлу.
+    """
+    __write_atomic(path, json.dumps(snapshot(), ensure_ascii=False, indent=4))
+
+
+def export_prometheus(path):
+    """Запись показателей в текстовом формате Prometheus (для node_exporter textfile collector).
+    @param path: полный путь к файлу (*.prom).
+    """
+    data = snapshot()
+    lines = []
+
+    def metric_line(name, labels, value):
+        label_str = ','.join('{0}="{1}"'.format(key, str(val).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, val in sorted(labels.items()))
+        return '{0}{1} {2}'.format(name, '{' + label_str + '}' if label_str else '', value)
+
+    for suffix, field, kind in (("seconds_total", "seconds", "counter"), ("count", "count", "counter"),
+                                ("seconds_max", "max", "gauge")):
+        names = sorted(set(item["name"] for item in data["timers"]))
+        for name in names:
+            metric = '{0}_{1}_{2}'.format(PROMETHEUS_PREFIX, name, suffix)
+            lines.append('# TYPE {0} {1}'.format(metric, kind))
+            lines += [metric_line(metric, item["labels"], item[field]) for item in data["timers"] if item["name"] == name]
+
+    for name in sorted(set(item["name"] for item in data["counters"])):
+        metric = '{0}_{1}_total'.format(PROMETHEUS_PREFIX, name)
+        lines.append('# TYPE {0} counter'.format(metric))
+        lines += [metric_line(metric, item["labels"], item["value"]) for item in data["counters"] if item["name"] == name]
+
+    metric = '{0}_last_run_timestamp_seconds'.format(PROMETHEUS_PREFIX)
+    lines.append('# TYPE {0} gauge'.format(metric))
+    lines.append(metric_line(metric, dict(), int(data["time"])))
+
+    __write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def __write_atomic(path, text):
+    """Запись файла через временный файл, чтобы читатели не видели его частично записанным."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+        file_handle.write(text)
+    os.replace(tmp_path, path)
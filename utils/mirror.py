@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+from utils import cache, log, metrics, state
+
+TEMPLATE_PREFIX = "template"
+PLATFORM_PREFIX = "platform"
+INDEX_PATH = "/index.json"
+SEND_BLOCK_SIZE = 1024 * 1024
+# Незавершенные файлы скачивания и распаковки не отдаются
+HIDDEN_SUFFIXES = (".part", ".segments", ".tmp")
+
+
+def file_path(prefix, *parts):
+    """Путь файла на зеркале.
+    @param prefix: TEMPLATE_PREFIX (каталог templatePath) или PLATFORM_PREFIX (каталог platformPath).
+    @param parts: части пути внутри каталога (templatePath из ответа сервиса 1С, имя файла).
+    @return: путь вида template/1c/Accounting/3_0_52_32/1cv8.zip.
+    """
+    return '/'.join([prefix] + [part.replace('\\', '/').strip('/') for part in parts])
+
+
+class MirrorServer:
+    """Зеркало скачанных обновлений для других экземпляров скрипта в локальной сети.
+    Отдает файлы каталогов templatePath и platformPath по HTTP с поддержкой Range
+    и условных запросов (If-None-Match, If-Modified-Since, If-Range), а также
+    индекс доступных архивов с размерами и контрольными суммами:
+        GET /index.json
+        GET /template/<templatePath>/1cv8.zip
+        GET /platform/<версия>.zip
+    Контрольные суммы берутся из хранилища состояния (statePath), где они сохраняются при
+    скачивании и проверке архивов. Суммы остальных архивов вычисляются в фоновом потоке
+    и сохраняются в хранилище состояния; до этого в индексе для них указывается null.
+    """
+
+    def __init__(self, settings):
+        """
+        @param settings: настройки обновления в виде словаря, параметры зеркала задаются блоком mirror:
+                         {
+                             "listenHost": "0.0.0.0",  - адрес, на котором зеркало принимает запросы
+                             "listenPort": 8766,       - порт зеркала (0 - зеркало не запускается)
+                             "upstream": ""            - адрес зеркала, с которого скачивать файлы
+                         }
+        """
+        mirror_settings = settings.get("mirror", dict())
+        self.host = mirror_settings.get("listenHost", "0.0.0.0")
+        self.port = mirror_settings.get("listenPort", 0)
+        self.__roots = {TEMPLATE_PREFIX: os.path.abspath(settings["templatePath"]),
+                        PLATFORM_PREFIX: os.path.abspath(settings["platformPath"])}
+        self.__state_path = settings.get("statePath", "state.db")
+        self.__state_store = None
+        self.__hashes = dict()
+        self.__hash_lock = threading.Lock()
+        # Очередь архивов на вычисление контрольной суммы и архивы, уже поставленные в очередь
+        self.__hash_queue = queue.Queue()
+        self.__queued = set()
+        self.__hash_thread = None
+        self.__server = None
+
+
+    def start(self):
+        """Запуск HTTP-сервера зеркала в фоновом потоке.
+        @return: адрес зеркала для настройки mirror.upstream других экземпляров.
+        """
+        service = self
+        self.__state_store = state.StateStore(self.__state_path)
+        self.__hash_thread = threading.Thread(target=self.__hash_worker, name='mirror-hash', daemon=True)
+        self.__hash_thread.start()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                service.handle(self, send_body=True)
+
+            def do_HEAD(self):
+                service.handle(self, send_body=False)
+
+        self.__server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, name='mirror', daemon=True).start()
+        address = 'http://{0}:{1}'.format(*self.__server.server_address)
+        log.info('Зеркало обновлений запущено: %s', address)
+        return address
+
+
+    def stop(self):
+        """Остановка HTTP-сервера зеркала."""
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+        if self.__hash_thread is not None:
+            self.__hash_queue.put(None)
+            self.__hash_thread.join()
+            self.__hash_thread = None
+        if self.__state_store is not None:
+            self.__state_store.close()
+            self.__state_store = None
+
+
+    def index(self):
+        """Индекс архивов, доступных на зеркале.
+        @return: словарь {"time": ..., "files": [{"path": ..., "size": ..., "modified": ..., "hashSum": ...}]},
+                 hashSum равен None, пока контрольная сумма архива вычисляется.
+        """
+        files = []
+        for prefix, root in sorted(self.__roots.items()):
+            for directory, _, names in os.walk(root):
+                for name in sorted(names):
+                    if not name.lower().endswith('.zip'):
+                        continue
+                    full_path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(full_path)
+                        hash_sum = self.__hash_sum(full_path, stat)
+                    except OSError:
+                        # Файл удален или заменен во время обхода каталога
+                        continue
+                    relative = os.path.relpath(full_path, root).split(os.sep)
+                    files.append({"path": file_path(prefix, *relative), "size": stat.st_size,
+                                  "modified": stat.st_mtime, "hashSum": hash_sum})
+        return {"time": time.time(), "files": files}
+
+
+    def handle(self, handler, send_body=True):
+        """Обработка запроса GET/HEAD к зеркалу."""
+        path = unquote(handler.path.split('?', 1)[0])
+        if path == INDEX_PATH:
+            text = json.dumps(self.index(), ensure_ascii=False).encode('utf-8')
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'application/json; charset=utf-8')
+            handler.send_header('Content-Length', str(len(text)))
+            handler.end_headers()
+            if send_body:
+                handler.wfile.write(text)
+            return
+
+        full_path = self.__resolve(path)
+        if full_path is None:
+            metrics.add('mirror_served', result='not_found')
+            handler.send_error(404)
+            return
+
+        self.__send_file(handler, full_path, send_body)
+
+
+    def __resolve(self, path):
+        """Полный путь к файлу по пути запроса; None, если файла нет или путь выходит за каталог зеркала."""
+        parts = [part for part in path.split('/') if part]
+        if len(parts) < 2 or parts[0] not in self.__roots:
+            return None
+        if any(part in ('.', '..') for part in parts) or parts[-1].endswith(HIDDEN_SUFFIXES):
+            return None
+
+        root = self.__roots[parts[0]]
+        candidates = [os.path.join(root, *parts[1:])]
+        if os.sep != '\\' and len(parts) > 3:
+            # Вне Windows templatePath из ответа сервиса 1С сохраняется как одно имя каталога с "\"
+            candidates.append(os.path.join(root, '\\'.join(parts[1:-1]), parts[-1]))
+
+        for candidate in candidates:
+            full_path = os.path.realpath(candidate)
+            if full_path.startswith(os.path.realpath(root) + os.sep) and os.path.isfile(full_path):
+                return full_path
+        return None
+
+
+    def __send_file(self, handler, full_path, send_body):
+        """Отдача файла целиком, диапазоном (Range) или ответом 304 на условный запрос."""
+        stat = os.stat(full_path)
+        file_size = stat.st_size
+        etag = '"{0:x}-{1:x}"'.format(file_size, stat.st_mtime_ns)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        if self.__not_modified(handler.headers, etag, stat.st_mtime):
+            metrics.add('mirror_served', result='not_modified')
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.send_header('Last-Modified', last_modified)
+            handler.end_headers()
+            return
+
+        start, end = 0, file_size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', handler.headers.get('Range', '').strip())
+        if_range = handler.headers.get('If-Range')
+        if match and (if_range is None or if_range in (etag, last_modified)):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                handler.send_response(416)
+                handler.send_header('Content-Range', 'bytes */{0}'.format(file_size))
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, file_size))
+        else:
+            handler.send_response(200)
+        handler.send_header('Content-Type', 'application/octet-stream')
+        handler.send_header('Content-Length', str(end - start + 1))
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('ETag', etag)
+        handler.send_header('Last-Modified', last_modified)
+        handler.end_headers()
+        if not send_body:
+            return
+
+        sent = 0
+        try:
+            with open(full_path, 'rb') as file_handle:
+                file_handle.seek(start)
+                remain = end - start + 1
+                while remain > 0:
+                    block = file_handle.read(min(SEND_BLOCK_SIZE, remain))
+                    if not block:
+                        break
+                    handler.wfile.write(block)
+                    remain -= len(block)
+                    sent += len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        metrics.add('mirror_served', result='ok')
+        metrics.add('mirror_bytes', sent)
+
+
+    @staticmethod
+    def __not_modified(headers, etag, mtime):
+        """Проверка условий If-None-Match / If-Modified-Since запроса."""
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [item.strip() for item in if_none_match.split(',')]
+
+        if_modified_since = headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+    def __hash_sum(self, full_path, stat):
+        """Контрольная сумма файла в формате сервиса 1С.
+        Сумма берется из сохраненных при скачивании и проверке архивов данных; если ее нет,
+        файл ставится в очередь на вычисление в фоновом потоке.
+        @return: контрольная сумма или None, если она еще не известна.
+        """
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self.__hash_lock:
+            known = self.__hashes.get(full_path)
+        if known is not None and known[0] == key:
+            return known[1]
+
+        hash_sum = self.__state_store.indexed_hash(full_path, stat.st_size, stat.st_mtime_ns)
+        if hash_sum is None:
+            record = self.__state_store.file(full_path)
+            if record is not None and record["status"] == state.FILE_OK and record["size"] == stat.st_size:
+                hash_sum = record["hash_sum"]
+
+        with self.__hash_lock:
+            if hash_sum is not None:
+                self.__hashes[full_path] = (key, hash_sum)
+            elif full_path not in self.__queued:
+                self.__queued.add(full_path)
+                self.__hash_queue.put(full_path)
+        return hash_sum
+
+
+    def __hash_worker(self):
+        """Фоновое вычисление контрольных сумм архивов, о которых нет сохраненных данных."""
+        while True:
+            full_path = self.__hash_queue.get()
+            if full_path is None:
+                return
+
+            try:
+                stat = os.stat(full_path)
+                hash_sum = cache.hash_sum(cache.file_hash(full_path))
+                # Файл, измененный во время вычисления, будет поставлен в очередь повторно
+                if os.stat(full_path).st_mtime_ns == stat.st_mtime_ns:
+                    self.__state_store.set_indexed_hash(full_path, stat.st_size, stat.st_mtime_ns, hash_sum)
+                    with self.__hash_lock:
+                        self.__hashes[full_path] = ((stat.st_size, stat.st_mtime_ns), hash_sum)
+            except OSError as ex:
+                log.debug('Не удалось вычислить контрольную сумму файла %s. %s', full_path, ex)
+            finally:
+                with self.__hash_lock:
+                    self.__queued.discard(full_path)
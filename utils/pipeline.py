@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+from utils import log
+
+# Признак окончания входных данных конвейера
+_END_OF_ITEMS = object()
+
+
+class Pipeline:
+    """Конвейер последовательной обработки элементов с ограниченными очередями между этапами.
+    Каждый этап выполняется в своем потоке, поэтому пока один элемент обрабатывается
+    на этапе N, следующий элемент может обрабатываться на этапе N-1. Порядок элементов
+    на выходе совпадает с порядком на входе.
+    """
+
+    def __init__(self, name, queue_size=1):
+        """
+        @param name: наименование конвейера для вывода в лог.
+        @param queue_size: максимальное количество элементов в очереди перед каждым этапом.
+        """
+        self.__name = name
+        self.__queue_size = max(1, queue_size)
+        self.__stages = []
+
+
+    def add_stage(self, name, handler):
+        """Добавление этапа обработки.
+        @param name: наименование этапа.
+        @param handler: функция обработки элемента; возвращает элемент для следующего этапа
+                        или None, если элемент дальше не передается.
+        @return: объект конвейера.
+        """
+        self.__stages.append({"name": name, "handler": handler,
+                              "queue": queue.Queue(self.__queue_size), "maxDepth": 0})
+        return self
+
+
+    def depths(self):
+        """Текущая длина очереди перед каждым этапом.
+        @return: словарь {наименование этапа: количество элементов в очереди}.
+        """
+        return {stage["name"]: stage["queue"].qsize() for stage in self.__stages}
+
+
+    def max_depths(self):
+        """Максимальная длина очереди перед каждым этапом за время работы конвейера.
+        Этап с постоянно заполненной очередью является узким местом.
+        @return: словарь {наименование этапа: максимальное количество элементов в очереди}.
+        """
+        return {stage["name"]: stage["maxDepth"] for stage in self.__stages}
+
+
+    def run(self, items):
+        """Обработка элементов всеми этапами конвейера.
+        @param items: последовательность входных элементов.
+        @return: список элементов, успешно прошедших все этапы.
+        """
+        results = []
+        threads = []
+        for index, stage in enumerate(self.__stages):
+            next_queue = self.__stages[index + 1]["queue"] if index + 1 < len(self.__stages) else None
+            thread = threading.Thread(target=self.__work, args=(stage, next_queue, results),
+                                      name='{0}-{1}'.format(self.__name, stage["name"]), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        first_queue = self.__stages[0]["queue"]
+        for item in items:
+            first_queue.put(item)
+        first_queue.put(_END_OF_ITEMS)
+
+        for thread in threads:
+            thread.join()
+
+        log.info(' -- Конвейер "%s": максимальная длина очередей %s.', self.__name,
+                 ', '.join('{0}={1}'.format(name, depth) for name, depth in self.max_depths().items()))
+
+        return results
+
+
+    def __work(self, stage, next_queue, results):
+        """Цикл обработки элементов одного этапа."""
+        while True:
+            item = stage["queue"].get()
+            if item is _END_OF_ITEMS:
+                if next_queue is not None:
+                    next_queue.put(_END_OF_ITEMS)
+                return
+
+            depth = stage["queue"].qsize() + 1
+            stage["maxDepth"] = max(stage["maxDepth"], depth)
+            log.debug(' ---- Конвейер "%s", этап %s: в очереди %s.', self.__name, stage["name"], depth)
+
+            try:
+                item = stage["handler"](item)
+            except Exception as ex:
+                log.error('Ошибка на этапе "%s" конвейера "%s". %s', stage["name"], self.__name, ex)
+                item = None
+
+            if item is None:
+                continue
+            if next_queue is None:
+                results.append(item)
+            else:
+                next_queue.put(item)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+
+PLATFORM = "platform"
+CONFIGURATION = "configuration"
+
+STAGE_DOWNLOADED = "downloaded"
+STAGE_EXTRACTED = "extracted"
+
+FILE_OK = "ok"
+FILE_BROKEN = "broken"
+
+FILE_COLUMNS = ("path", "kind", "name", "version", "sequence", "program_uin", "size", "hash_sum", "status")
+
+
+class StateStore:
+    """Хранилище хода скачивания обновлений в базе SQLite.
+    Отметки о последних скачанных версиях и о каждом обработанном элементе цепочки
+    обновлений записываются отдельными транзакциями, поэтому прерванный запуск
+    продолжается с того места, где он был остановлен.
+    Для каждого скачанного архива хранятся размер и контрольная сумма (для проверки
+    целостности хранилища) и данные, по которым поврежденный архив скачивается повторно.
+    Отметки о скачанных версиях имеют приоритет над lastDownloaded из settings.json, пока
+    версии в settings.json не изменены (см. last_downloaded()).
+    """
+
+    def __init__(self, path):
+        """
+        @param path: полный путь к файлу базы состояния.
+        """
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=FULL')
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS versions ('
+                                      'kind TEXT NOT NULL, name TEXT NOT NULL, last_downloaded TEXT NOT NULL, '
+                                      'updated REAL NOT NULL, PRIMARY KEY (kind, name))')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS chain_items ('
+                                      'name TEXT NOT NULL, target_version TEXT NOT NULL, sequence TEXT NOT NULL, '
+                                      'stage TEXT NOT NULL, template_path TEXT, updated REAL NOT NULL, '
+                                      'PRIMARY KEY (name, target_version, sequence))')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                      'path TEXT NOT NULL PRIMARY KEY, kind TEXT NOT NULL, name TEXT NOT NULL, '
+                                      'version TEXT NOT NULL, sequence TEXT, program_uin TEXT, size INTEGER NOT NULL, '
+                                      'hash_sum TEXT, status TEXT NOT NULL, updated REAL NOT NULL)')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS hash_index ('
+                                      'path TEXT NOT NULL PRIMARY KEY, size INTEGER NOT NULL, '
+                                      'mtime INTEGER NOT NULL, hash_sum TEXT NOT NULL)')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS configured_versions ('
+                                      'kind TEXT NOT NULL, name TEXT NOT NULL, configured TEXT NOT NULL, '
+                                      'PRIMARY KEY (kind, name))')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """Закрытие базы состояния."""
+        with self.__lock:
+            self.__connection.close()
+
+
+    def last_downloaded(self, kind, name, default="", configured=None):
+        """Последняя полностью скачанная версия.
+        @param kind: вид обновления (PLATFORM или CONFIGURATION).
+        @param name: название конфигурации (programName) или платформы.
+        @param default: значение, если отметки нет (например, lastDownloaded из settings.json).
+        @param configured: версии из settings.json в виде строки (startVersion и lastDownloaded);
+                           если они изменились с предыдущего запуска, отметка о скачанной версии
+                           удаляется и возвращается default.
+        @return: номер версии.
+        """
+        with self.__lock, self.__connection:
+            if configured is not None:
+                row = self.__connection.execute('SELECT configured FROM configured_versions '
+                                                'WHERE kind = ? AND name = ?', (kind, name)).fetchone()
+                if row is None or row[0] != configured:
+                    if row is not None:
+                        # Явное изменение settings.json имеет приоритет над отметкой о скачанной версии
+                        self.__connection.execute('DELETE FROM versions WHERE kind = ? AND name = ?', (kind, name))
+                    self.__connection.execute('INSERT OR REPLACE INTO configured_versions (kind, name, configured) '
+                                              'VALUES (?, ?, ?)', (kind, name, configured))
+            row = self.__connection.execute('SELECT last_downloaded FROM versions WHERE kind = ? AND name = ?',
+                                            (kind, name)).fetchone()
+        return default if row is None else row[0]
+
+
+    def set_last_downloaded(self, kind, name, version):
+        """Фиксация полностью скачанной версии.
+        Отметки об элементах цепочки обновлений до этой версии удаляются в той же транзакции.
+        @param kind: вид обновления (PLATFORM или CONFIGURATION).
+        @param name: название конфигурации (programName) или платформы.
+        @param version: номер версии.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO versions (kind, name, last_downloaded, updated) '
+                                      'VALUES (?, ?, ?, ?)', (kind, name, version, time.time()))
+            self.__connection.execute('DELETE FROM chain_items WHERE name = ? AND target_version = ?',
+                                      (name, version))
+
+
+    def chain_stage(self, name, target_version, sequence):
+        """Этап, до которого обработан элемент цепочки обновлений.
+        @param name: название конфигурации (programName).
+        @param target_version: версия, к которой ведет цепочка.
+        @param sequence: идентификатор элемента цепочки (из upgradeSequence).
+        @return: STAGE_DOWNLOADED, STAGE_EXTRACTED или None, если элемент не обрабатывался.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT stage FROM chain_items '
+                                            'WHERE name = ? AND target_version = ? AND sequence = ?',
+                                            (name, target_version, sequence)).fetchone()
+        return None if row is None else row[0]
+
+
+    def set_chain_stage(self, name, target_version, sequence, stage, template_path=None):
+        """Фиксация обработки элемента цепочки обновлений.
+        @param name: название конфигурации (programName).
+        @param target_version: версия, к которой ведет цепочка.
+        @param sequence: идентификатор элемента цепочки (из upgradeSequence).
+        @param stage: STAGE_DOWNLOADED или STAGE_EXTRACTED.
+        @param template_path: каталог элемента цепочки (templatePath).
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO chain_items '
+                                      '(name, target_version, sequence, stage, template_path, updated) '
+                                      'VALUES (?, ?, ?, ?, ?, ?)',
+                                      (name, target_version, sequence, stage, template_path, time.time()))
+
+
+    def set_file(self, path, kind, name, version, sequence, program_uin, size, hash_sum=None):
+        """Фиксация скачанного архива (с отметкой о целостности FILE_OK).
+        @param path: полный путь к архиву.
+        @param kind: вид обновления (PLATFORM или CONFIGURATION).
+        @param name: название конфигурации (programName) или платформы.
+        @param version: версия, к которой относится архив.
+        @param sequence: идентификатор элемента цепочки (upgradeSequence) или дистрибутива платформы (distributionUin).
+        @param program_uin: идентификатор программы (programVersionUin) для повторного получения ссылки.
+        @param size: размер архива в байтах.
+        @param hash_sum: контрольная сумма архива (hashSum), если известна.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO files '
+                                      '(path, kind, name, version, sequence, program_uin, size, hash_sum, status, updated) '
+                                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                      (path, kind, name, version, sequence, program_uin, size, hash_sum, FILE_OK,
+                                       time.time()))
+
+
+    def file(self, path):
+        """Сведения о скачанном архиве.
+        @param path: полный путь к архиву.
+        @return: словарь с ключами FILE_COLUMNS или None, если архив не зафиксирован.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT {0} FROM files WHERE path = ?'.format(', '.join(FILE_COLUMNS)),
+                                            (path,)).fetchone()
+        return None if row is None else dict(zip(FILE_COLUMNS, row))
+
+
+    def files(self, status=None):
+        """Сведения о скачанных архивах.
+        @param status: отбор по отметке о целостности (FILE_OK, FILE_BROKEN), по умолчанию все архивы.
+        @return: список словарей с ключами FILE_COLUMNS.
+        """
+        query = 'SELECT {0} FROM files'.format(', '.join(FILE_COLUMNS))
+        with self.__lock:
+            if status is None:
+                rows = self.__connection.execute(query).fetchall()
+            else:
+                rows = self.__connection.execute(query + ' WHERE status = ?', (status,)).fetchall()
+        return [dict(zip(FILE_COLUMNS, row)) for row in rows]
+
+
+    def set_file_status(self, path, status):
+        """Изменение отметки о целостности архива.
+        @param path: полный путь к архиву.
+        @param status: FILE_OK или FILE_BROKEN (поврежденный архив скачивается повторно при следующем запуске).
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('UPDATE files SET status = ?, updated = ? WHERE path = ?',
+                                      (status, time.time(), path))
+
+
+    def indexed_hash(self, path, size, mtime):
+        """Контрольная сумма файла, вычисленная при предыдущей проверке.
+        @param path: полный путь к файлу.
+        @param size: текущий размер файла в байтах.
+        @param mtime: текущее время изменения файла (st_mtime_ns).
+        @return: контрольная сумма или None, если файл не проверялся или изменился после проверки.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT hash_sum FROM hash_index WHERE path = ? AND size = ? AND mtime = ?',
+                                            (path, size, mtime)).fetchone()
+        return None if row is None else row[0]
+
+
+    def set_indexed_hash(self, path, size, mtime, hash_sum):
+        """Сохранение контрольной суммы файла для последующих проверок.
+        @param path: полный путь к файлу.
+        @param size: размер файла в байтах.
+        @param mtime: время изменения файла (st_mtime_ns).
+        @param hash_sum: контрольная сумма файла.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO hash_index (path, size, mtime, hash_sum) '
+                                      'VALUES (?, ?, ?, ?)', (path, size, mtime, hash_sum))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from datetime import datetime
+
+# Период пересчета скорости по расписанию, секунд
+SCHEDULE_CHECK_PERIOD = 30
+
+
+class BandwidthLimiter:
+    """Общее для всех потоков скачивания ограничение скорости по алгоритму token bucket.
+    Скорость может зависеть от времени суток: например, без ограничения ночью
+    и 20 Мбит/с в рабочее время.
+    """
+
+    def __init__(self, rate=0, burst=4, schedule=None):
+        """
+        @param rate: скорость в Мбит/с вне интервалов расписания (0 - без ограничения).
+        @param burst: объем данных в Мб, который можно получить без задержки после простоя.
+        @param schedule: список интервалов расписания:
+                         [
+                             {"from": "08:00", "to": "20:00", "rate": 20},
+                             {"from": "20:00", "to": "08:00", "rate": 0}
+                         ]
+        """
+        self.__default_rate = self.__bytes_per_second(rate)
+        self.__burst = burst * 1024 * 1024
+        self.__schedule = [(self.__minutes(item["from"]), self.__minutes(item["to"]),
+                            self.__bytes_per_second(item["rate"])) for item in (schedule or [])]
+
+        self.__lock = threading.Lock()
+        self.__tokens = self.__burst
+        self.__updated = time.monotonic()
+        self.__rate = self.__default_rate
+        self.__rate_checked = None
+
+
+    @classmethod
+    def from_settings(cls, limit_config):
+        """Создание ограничителя по настройке bandwidthLimit.
+        @param limit_config: словарь {"rate": ..., "burst": ..., "schedule": [...]} или None.
+        @return: объект BandwidthLimiter или None, если ограничение не задано.
+        """
+        if not limit_config or not (limit_config.get("rate", 0) or limit_config.get("schedule")):
+            return None
+        return cls(limit_config.get("rate", 0), limit_config.get("burst", 4), limit_config.get("schedule"))
+
+
+    def consume(self, amount):
+        """Учет полученных данных; при превышении скорости вызывающий поток приостанавливается.
+        @param amount: количество полученных байт.
+        """
+        rate = self.__current_rate()
+        if not rate:
+            return
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated) * rate)
+            self.__updated = now
+            self.__tokens -= amount
+            wait = -self.__tokens / rate if self.__tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+    def __current_rate(self):
+        """Действующая скорость в байтах/с (0 - без ограничения), пересчитывается раз в SCHEDULE_CHECK_PERIOD."""
+        if not self.__schedule:
+            return self.__default_rate
+
+        now = time.monotonic()
+        if self.__rate_checked is None or now - self.__rate_checked >= SCHEDULE_CHECK_PERIOD:
+            current = datetime.now()
+            minutes = current.hour * 60 + current.minute
+            rate = self.__default_rate
+            for start, end, item_rate in self.__schedule:
+                # Интервал может переходить через полночь
+                if (start <= minutes < end) if start <= end else (minutes >= start or minutes < end):
+                    rate = item_rate
+                    break
+            self.__rate = rate
+            self.__rate_checked = now
+
+        return self.__rate
+
+
+    @staticmethod
+    def __bytes_per_second(rate):
+        """Перевод скорости из Мбит/с в байты/с."""
+        return rate * 1000 * 1000 / 8
+
+
+    @staticmethod
+    def __minutes(value):
+        """Перевод времени "ЧЧ:ММ" в минуты от начала суток."""
+        hours, minutes = value.split(':')
+        return int(hours) * 60 + int(minutes)
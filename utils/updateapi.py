@@ -2,9 +2,14 @@
 
 import base64
 import json
+import os
+import random
+import time
+import urllib.parse
 import requests
+import requests.adapters
 import urllib3
-from utils import log
+from utils import cache, log, metrics
 
 # Отключение предупреждений SSL
 urllib3.disable_warnings()
@@ -15,10 +20,51 @@ class ApiConnector:
     API_URL = "https://update-api.1c.ru/update-platform/programs"
     BODY_TEMPLATE = '{{"programName":"{0}","versionNumber":"{1}","platformVersion":"{2}","updateType":"{3}"}}'
     PROXIES = ""
-
-    def __init__(self, its_login, its_password, proxy_config=None):
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+    DOWNLOAD_ATTEMPTS = 3
+    PART_SUFFIX = ".part"
+    SEGMENTS_SUFFIX = ".segments"
+    DOWNLOAD_SEGMENT_SIZE = 16 * 1024 * 1024
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    MAX_BACKOFF = 60
+    MIRROR_RETRY_PERIOD = 300
+
+    def __init__(self, its_login, its_password, proxy_config=None, connection_config=None, response_cache=None,
+                 bandwidth_limiter=None, mirror_url=None):
+        """
+        @param its_login: логин учетной записи ИТС.
+        @param its_password: пароль учетной записи ИТС.
+        @param proxy_config: настройки прокси-сервера (proxySettings).
+        @param connection_config: настройки соединений (connection) в виде словаря:
+                                  {
+                                      "poolSize": 10,      - количество соединений в пуле
+                                      "timeout": 60,       - таймаут соединения и чтения в секундах
+                                      "retries": 5,        - количество повторов при временных ошибках
+                                      "backoffFactor": 0.5 - начальная задержка перед повтором в секундах
+                                  }
+        @param response_cache: кэш ответов проверки обновлений (cache.ResponseCache).
+        @param bandwidth_limiter: общее ограничение скорости скачивания (throttle.BandwidthLimiter).
+        @param mirror_url: адрес зеркала в локальной сети (mirror.upstream), с которого файлы
+                           скачиваются в первую очередь (см. utils/mirror.py).
+        """
         self.__its_login = its_login
         self.__its_password = its_password
+        self.__response_cache = response_cache
+        self.__bandwidth_limiter = bandwidth_limiter
+        self.__mirror_url = mirror_url.rstrip('/') if mirror_url else None
+        self.__mirror_down_until = 0
+
+        connection_config = dict() if connection_config is None else connection_config
+        pool_size = connection_config.get("poolSize", 10)
+        self.__timeout = connection_config.get("timeout", 60)
+        self.__retries = connection_config.get("retries", 5)
+        self.__backoff_factor = connection_config.get("backoffFactor", 0.5)
+
+        # Общий пул соединений с keep-alive для всех запросов коннектора
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session = requests.Session()
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
 
         proxy_host = '' if proxy_config is None else proxy_config["host"]
         proxy_port = '' if proxy_config is None else proxy_config["port"]
@@ -30,9 +76,53 @@ class ApiConnector:
             self.PROXIES = {'http': proxy_url, 'https': proxy_url}
 
 
-    def check_platform_update(self, current_version):
+    def close(self):
+        """Закрытие соединений пула."""
+        self.__session.close()
+
+
+    def __request(self, method, url, retries=None, **kwargs):
+        """Выполнение HTTP-запроса через общий пул соединений.
+        При ошибках соединения, таймаутах и ответах с кодами RETRY_STATUSES запрос повторяется
+        с экспоненциально растущей задержкой со случайным разбросом.
+        @param retries: количество повторов (по умолчанию из настройки connection.retries).
+        @return: объект ответа requests.Response.
+        """
+        retries = self.__retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                # Для API учитывается время всего запроса, для скачивания - время до получения заголовков ответа
+                with metrics.timer('api_call' if method == 'POST' else 'download_ttfb',
+                                   endpoint=url[len(self.API_URL):] if url.startswith(self.API_URL) else 'file'):
+                    http_response = self.__session.request(method, url, proxies=self.PROXIES, verify=False,
+                                                           timeout=self.__timeout, **kwargs)
+                if (http_response.status_code not in self.RETRY_STATUSES) or attempt >= retries:
+                    return http_response
+                retry_after = http_response.headers.get('Retry-After', '')
+                http_response.close()
+                log.warn('Сервер вернул код %s на запрос %s, повтор %s из %s.',
+                         http_response.status_code, url, attempt + 1, retries)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                metrics.add('http_errors')
+                if attempt >= retries:
+                    raise
+                retry_after = ''
+                log.warn('Ошибка соединения при запросе %s, повтор %s из %s: %s', url, attempt + 1, retries, ex)
+
+            metrics.add('http_retries')
+            delay = min(self.MAX_BACKOFF, self.__backoff_factor * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+            attempt += 1
+
+
+    def check_platform_update(self, current_version, use_cache=True):
         """Получение информации о доступных обновлениях платформы 1С.
         @param current_version: проверяемая версия платформы 1С.
+        @param use_cache: использовать кэш ответов, если он задан.
         @return: информация о доступных обновлениях в виде словаря:
                  {
                      "platformVersion": "8.3.11.2867",
@@ -43,24 +133,32 @@ class ApiConnector:
                      "recommended": false
                  }
         """
+        cache_key = cache.ResponseCache.key('Platform', current_version, 'NewPlatform')
+        result = self.__cached_response(cache_key, use_cache)
+        if not result is None:
+            return result
+
         request_url = "{0}/update/info".format(self.API_URL)
         request_body = self.BODY_TEMPLATE.format('HRM', '3.1', current_version, 'NewPlatform')
 
-        result = None
         try:
-            http_response = requests.post(request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'}, proxies=self.PROXIES, verify=False)
+            http_response = self.__request('POST', request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'})
             resp_dict = json.loads(http_response.text)
             result = resp_dict["platformUpdateResponse"]
         except Exception as ex:
-            log.error('Ошибка при проверке обновлений платформы 1С.', str(ex))
+            log.error('Ошибка при проверке обновлений платформы 1С. %s', ex)
+
+        if not self.__response_cache is None:
+            self.__response_cache.put(cache_key, result)
 
         return result
 
 
-    def check_conf_update(self, conf_name, conf_version):
+    def check_conf_update(self, conf_name, conf_version, use_cache=True):
         """Получение информации о доступных обновлениях конфигурации 1С.
         @param conf_name: название конфигурации.
         @param conf_version: проверяемая версия конфигурации.
+        @param use_cache: использовать кэш ответов, если он задан.
         @return: информация о доступных обновлениях в виде словаря:
                  {
                     "configurationVersion": "3.1.3.274",
@@ -75,17 +173,37 @@ class ApiConnector:
                     "programVersionUin": "de35e1b9-2e0d-4f32-8269-cf61a6010c04"
                  }
         """
+        cache_key = cache.ResponseCache.key(conf_name, conf_version, 'NewProgramOrRedaction')
+        result = self.__cached_response(cache_key, use_cache)
+        if not result is None:
+            return result
+
         request_url = "{0}/update/info".format(self.API_URL)
         request_body = self.BODY_TEMPLATE.format(conf_name, conf_version, '', 'NewProgramOrRedaction')
 
-        result = None
         try:
-            http_response = requests.post(request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'}, proxies=self.PROXIES, verify=False)
+            http_response = self.__request('POST', request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'})
             resp_dict = json.loads(http_response.text)
             result = resp_dict["configurationUpdateResponse"]
         except Exception as ex:
-            log.error('Ошибка при проверке обновлений конфигурации 1С.', str(ex))
+            log.error('Ошибка при проверке обновлений конфигурации 1С. %s', ex)
+
+        if not self.__response_cache is None:
+            self.__response_cache.put(cache_key, result)
+
+        return result
+
 
+    def __cached_response(self, cache_key, use_cache):
+        """Ответ сервиса из кэша ответов.
+        @return: сохраненный ответ или None, если кэш не задан, не используется или не содержит записи.
+        """
+        if self.__response_cache is None or not use_cache:
+            return None
+
+        result = self.__response_cache.get(cache_key)
+        if not result is None:
+            log.debug('Ответ сервиса обновлений для %s взят из кэша.', cache_key)
         return result
 
 
@@ -104,11 +222,11 @@ class ApiConnector:
 
         result = None
         try:
-            http_response = requests.post(request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'}, proxies=self.PROXIES, verify=False)
+            http_response = self.__request('POST', request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'})
             resp_dict = json.loads(http_response.text)
             result = resp_dict["platformDistributionUrl"]
         except Exception as ex:
-            log.error('Ошибка при получении ссылки на скачивание платформы 1С.', str(ex))
+            log.error('Ошибка при получении ссылки на скачивание платформы 1С. %s', ex)
 
         return result
 
@@ -139,10 +257,10 @@ class ApiConnector:
 
         resp_dict = None
         try:
-            http_response = requests.post(request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'}, proxies=self.PROXIES, verify=False)
+            http_response = self.__request('POST', request_url, data=request_body.encode("utf-8"), headers={'Content-Type': 'application/json'})
             resp_dict = json.loads(http_response.text)
         except Exception as ex:
-            log.error('Ошибка при получении ссылки на скачивание конфигурации 1С.', str(ex))
+            log.error('Ошибка при получении ссылки на скачивание конфигурации 1С. %s', ex)
 
         result = None
         if (not resp_dict is None) and (not resp_dict["configurationUpdateDataList"] is None):
@@ -151,30 +269,442 @@ class ApiConnector:
         return result
 
 
-    def download_file(self, url):
-        """Скачать файл с сайта обновлений 1С.
+    def download_file(self, url, target, chunk_size=None, expected_size=None, attempts=None,
+                      segments=1, segment_size=None, expected_hash=None, mirror_path=None):
+        """Скачать файл с сайта обновлений 1С с потоковой записью данных.
+        Если target задан путем к файлу, данные пишутся во временный файл <target>.part,
+        при повторной попытке (или следующем запуске) скачивание продолжается запросом Range
+        с уже полученного смещения. Готовый файл переименовывается в target только после
+        совпадения размера с ожидаемым.
+        При segments > 1 файл делится на диапазоны по segment_size байт, которые скачиваются
+        параллельно в segments соединений; если сервер не поддерживает Range, файл
+        скачивается одним потоком.
+        Если задан expected_hash, контрольная сумма вычисляется по ходу скачивания; файл с
+        несовпадающей суммой удаляется и скачивается заново.
+        Если задан адрес зеркала и mirror_path, файл сначала запрашивается с зеркала и скачивается
+        с сайта 1С, только если на зеркале его нет или зеркало недоступно.
         @param url: адрес файла для скачивания.
-        @return: двоичные данные файла
+        @param target: полный путь к файлу либо файлоподобный объект, в который записываются данные.
+        @param chunk_size: размер блока чтения в байтах (по умолчанию DOWNLOAD_CHUNK_SIZE).
+        @param expected_size: ожидаемый размер файла в байтах (поле size ответа сервиса 1С).
+        @param attempts: количество попыток скачивания (по умолчанию DOWNLOAD_ATTEMPTS).
+        @param segments: количество параллельных соединений для скачивания файла по частям.
+        @param segment_size: размер одной части в байтах (по умолчанию DOWNLOAD_SEGMENT_SIZE).
+        @param expected_hash: ожидаемая контрольная сумма файла (поле hashSum ответа сервиса 1С).
+        @param mirror_path: путь файла на зеркале (см. mirror.file_path()).
+        @return: размер файла в байтах или None в случае ошибки.
         """
-        import progressbar
+        if chunk_size is None:
+            chunk_size = self.DOWNLOAD_CHUNK_SIZE
+        if attempts is None:
+            attempts = self.DOWNLOAD_ATTEMPTS
+        if segment_size is None:
+            segment_size = self.DOWNLOAD_SEGMENT_SIZE
+
+        if not isinstance(target, str):
+            result = None
+            started = time.perf_counter()
+            try:
+                http_response = self.__request('GET', url, headers=self.__download_headers(url), stream=True)
+                http_response.raise_for_status()
+                file_size = int(http_response.headers['Content-Length'])
+                hasher = None if expected_hash is None else cache.new_hash()
+                result = self.__write_stream(http_response, target, 0, file_size, chunk_size, hasher, self.__bandwidth_limiter)
+                self.__check_hash(hasher, expected_hash)
+            except Exception as ex:
+                log.error('Ошибка при скачивании файла обновления. %s', ex)
+            metrics.add_time('download', time.perf_counter() - started, result='ok' if result is not None else 'error')
+            return result
+
+        if (expected_size is not None) and os.path.isfile(target) and os.path.getsize(target) == expected_size:
+            if (expected_hash is None) or cache.hash_sum(cache.file_hash(target)) == expected_hash:
+                log.info(' ---- Файл %s уже скачан.', target)
+                return expected_size
+            log.warn(' ---- Контрольная сумма файла %s не совпадает, файл будет скачан заново.', target)
+            os.remove(target)
+
+        result = None
+        started = time.perf_counter()
+        if (self.__mirror_url is not None) and (mirror_path is not None):
+            result = self.__download_from_mirror(mirror_path, target, chunk_size, expected_size, expected_hash)
+        for attempt in range(1, attempts + 1):
+            if result is not None:
+                break
+            try:
+                file_size = self.__range_size(url) if segments > 1 else None
+                if file_size is None:
+                    result = self.__download_part(url, target, chunk_size, expected_size, expected_hash)
+                else:
+                    if (expected_size is not None) and file_size != expected_size:
+                        raise IOError('Размер файла на сервере {0} не совпадает с ожидаемым {1}.'.format(file_size, expected_size))
+                    result = self.__download_segmented(url, target, chunk_size, file_size, segments, segment_size,
+                                                       attempts, expected_hash)
+                break
+            except Exception as ex:
+                log.error('Ошибка при скачивании файла обновления (попытка %s из %s). %s', attempt, attempts, ex)
+
+        metrics.add_time('download', time.perf_counter() - started, result='ok' if result is not None else 'error')
+        return result
+
+
+    def __download_part(self, url, target, chunk_size, expected_size, expected_hash=None, retries=None):
+        """Скачивание (или докачка) файла через временный файл <target>.part.
+        Контрольная сумма вычисляется по ходу записи (при докачке - с учетом уже скачанной части).
+        @param retries: количество повторов запроса при временных ошибках (см. __request()).
+        @return: размер скачанного файла в байтах.
+        """
+        part_path = target + self.PART_SUFFIX
+        state_path = part_path + self.SEGMENTS_SUFFIX
+        # Частично скачанный по сегментам файл не годится для последовательной докачки,
+        # но его состояние отбрасывается, только когда сервер начал отдавать файл
+        segmented = os.path.isfile(state_path)
+
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) and not segmented else 0
+        if (expected_size is not None) and offset > expected_size:
+            offset = 0
+
+        hasher = None if expected_hash is None else cache.new_hash()
+        if (hasher is not None) and offset > 0:
+            cache.file_hash(part_path, hasher, offset)
+
+        if (expected_size is None) or offset < expected_size:
+            headers = self.__download_headers(url)
+            if offset > 0:
+                headers['Range'] = 'bytes={0}-'.format(offset)
+
+            http_response = self.__request('GET', url, retries, headers=headers, stream=True)
+            if http_response.status_code == 416:
+                # Сервер не может отдать запрошенный диапазон - начинаем заново
+                http_response.close()
+                os.remove(part_path)
+                raise IOError('Сервер отклонил запрос диапазона с байта {0}.'.format(offset))
+            http_response.raise_for_status()
+
+            if http_response.status_code == 206:
+                file_size = int(http_response.headers['Content-Range'].rsplit('/', 1)[1])
+            else:
+                # Сервер не поддерживает Range - файл отдается целиком
+                offset = 0
+                hasher = None if expected_hash is None else cache.new_hash()
+                file_size = int(http_response.headers['Content-Length'])
+
+            if (expected_size is not None) and file_size != expected_size:
+                http_response.close()
+                raise IOError('Размер файла на сервере {0} не совпадает с ожидаемым {1}.'.format(file_size, expected_size))
+
+            if segmented:
+                os.remove(state_path)
+            with open(part_path, 'ab' if offset > 0 else 'wb') as file_handle:
+                offset += self.__write_stream(http_response, file_handle, offset, file_size, chunk_size, hasher,
+                                              self.__bandwidth_limiter)
+
+        try:
+            self.__check_hash(hasher, expected_hash)
+        except IOError:
+            os.remove(part_path)
+            raise
+
+        os.replace(part_path, target)
+        return offset
+
+
+    def __download_from_mirror(self, mirror_path, target, chunk_size, expected_size, expected_hash):
+        """Скачивание файла с зеркала в локальной сети без повторов запроса.
+        При ошибке соединения зеркало не используется в течение MIRROR_RETRY_PERIOD секунд.
+        @return: размер скачанного файла в байтах или None, если файл не получен с зеркала.
+        """
+        if time.monotonic() < self.__mirror_down_until:
+            return None
+
+        url = '{0}/{1}'.format(self.__mirror_url, urllib.parse.quote(mirror_path))
+        try:
+            result = self.__download_part(url, target, chunk_size, expected_size, expected_hash, retries=0)
+        except Exception as ex:
+            if isinstance(ex, (requests.ConnectionError, requests.Timeout)):
+                self.__mirror_down_until = time.monotonic() + self.MIRROR_RETRY_PERIOD
+            metrics.add('mirror_requests', result='miss')
+            log.info(' ---- Файл %s не получен с зеркала, скачивание с сайта 1С. %s', mirror_path, ex)
+            return None
+
+        metrics.add('mirror_requests', result='hit')
+        log.info(' ---- Файл %s получен с зеркала %s.', mirror_path, self.__mirror_url)
+        return result
+
+
+    def __range_size(self, url):
+        """Проверка поддержки сервером запросов Range.
+        @return: полный размер файла в байтах или None, если диапазоны не поддерживаются.
+        """
+        headers = self.__download_headers(url)
+        headers['Range'] = 'bytes=0-0'
+
+        http_response = self.__request('GET', url, headers=headers, stream=True)
+        http_response.close()
+        if http_response.status_code != 206 or 'Content-Range' not in http_response.headers:
+            return None
+
+        return int(http_response.headers['Content-Range'].rsplit('/', 1)[1])
 
+
+    def __download_segmented(self, url, target, chunk_size, file_size, segments, segment_size, attempts,
+                             expected_hash=None):
+        """Скачивание файла по частям в несколько параллельных соединений.
+        Каждая часть записывается по своему смещению в заранее выделенный файл <target>.part,
+        номера скачанных частей сохраняются в <target>.part.segments для продолжения после сбоя.
+        Части приходят не по порядку, поэтому контрольная сумма вычисляется по готовому файлу.
+        @return: размер скачанного файла в байтах.
+        """
+        import progressbar
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        part_path = target + self.PART_SUFFIX
+        state_path = part_path + self.SEGMENTS_SUFFIX
+
+        # Номера уже скачанных частей (учитываются только при совпадении разбиения)
+        done = set()
+        if os.path.isfile(state_path) and os.path.isfile(part_path):
+            with open(state_path, 'r', encoding='utf-8') as file_handle:
+                state = json.load(file_handle)
+            if state["size"] == file_size and state["segmentSize"] == segment_size:
+                done = set(state["done"])
+
+        if not done:
+            with open(part_path, 'wb') as file_handle:
+                file_handle.truncate(file_size)
+
+        ranges = [(index, start, min(start + segment_size, file_size) - 1)
+                  for index, start in enumerate(range(0, file_size, segment_size))]
+        pending = [item for item in ranges if item[0] not in done]
+
+        lock = threading.Lock()
+        progress = {"bytes": sum(end - start + 1 for index, start, end in ranges if index in done)}
+        progress_bar = progressbar.ProgressBar(maxval=file_size).start()
+        progress_bar.update(progress["bytes"])
+
+        def save_state():
+            tmp_path = state_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+                json.dump({"size": file_size, "segmentSize": segment_size, "done": sorted(done)}, file_handle)
+            os.replace(tmp_path, state_path)
+
+        def fetch(index, start, end):
+            for attempt in range(1, attempts + 1):
+                written = 0
+                try:
+                    headers = self.__download_headers(url)
+                    headers['Range'] = 'bytes={0}-{1}'.format(start, end)
+                    http_response = self.__request('GET', url, headers=headers, stream=True)
+                    http_response.raise_for_status()
+                    if http_response.status_code != 206:
+                        http_response.close()
+                        raise IOError('Сервер не вернул диапазон {0}-{1}.'.format(start, end))
+
+                    write_time = 0.0
+                    try:
+                        with open(part_path, 'r+b') as file_handle:
+                            file_handle.seek(start)
+                            for chunk in http_response.iter_content(chunk_size):
+                                write_started = time.perf_counter()
+                                file_handle.write(chunk)
+                                write_time += time.perf_counter() - write_started
+                                written += len(chunk)
+                                with lock:
+                                    progress["bytes"] += len(chunk)
+                                    progress_bar.update(progress["bytes"])
+                                if self.__bandwidth_limiter is not None:
+                                    self.__bandwidth_limiter.consume(len(chunk))
+                    finally:
+                        metrics.add('download_bytes', written)
+                        metrics.add_time('write', write_time)
+
+                    if written != end - start + 1:
+                        raise IOError('Получено {0} байт из {1}.'.format(written, end - start + 1))
+
+                    with lock:
+                        done.add(index)
+                        save_state()
+                    return True
+                except Exception as ex:
+                    with lock:
+                        progress["bytes"] -= written
+                    log.error('Ошибка при скачивании части %s файла (попытка %s из %s). %s', index, attempt, attempts, ex)
+            return False
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            results = list(executor.map(lambda item: fetch(*item), pending))
+        progress_bar.finish()
+
+        if not all(results):
+            raise IOError('Не удалось скачать {0} из {1} частей файла.'.format(results.count(False), len(ranges)))
+
+        if os.path.isfile(state_path):
+            os.remove(state_path)
+
+        if expected_hash is not None:
+            try:
+                self.__check_hash(cache.file_hash(part_path), expected_hash)
+            except IOError:
+                os.remove(part_path)
+                raise
+
+        os.replace(part_path, target)
+        return file_size
+
+
+    def __download_headers(self, url):
+        """Заголовки запроса для скачивания файлов с базовой авторизацией ИТС.
+        Учетные данные ИТС не передаются на зеркало в локальной сети."""
+        if (self.__mirror_url is not None) and url.startswith(self.__mirror_url + '/'):
+            return {'User-Agent': '1C+Enterprise/8.3'}
         auth_str = "{0}:{1}".format(self.__its_login, self.__its_password)
         base64_auth_str = base64.b64encode(auth_str.encode("utf-8"))
         authorization = "Basic {0}".format(base64_auth_str.decode())
+        return {'User-Agent': '1C+Enterprise/8.3', 'Authorization': authorization}
 
-        result = None
-        try:
-            http_response = requests.get(url, headers={'User-Agent': '1C+Enterprise/8.3', 'Authorization': authorization}, proxies=self.PROXIES, verify=False, stream=True)
-            file_size = int(http_response.headers['Content-Length'])
 
-            result = []
-            chunk_size = 1024
-            progress_bar = progressbar.ProgressBar(maxval=file_size).start()
+    @staticmethod
+    def __check_hash(hasher, expected_hash):
+        """Сверка вычисленной контрольной суммы с ожидаемой; при расхождении вызывается IOError."""
+        if (hasher is None) or (expected_hash is None):
+            return
+
+        actual_hash = cache.hash_sum(hasher)
+        if actual_hash != expected_hash:
+            raise IOError('Контрольная сумма {0} не совпадает с ожидаемой {1}.'.format(actual_hash, expected_hash))
+
+
+    @staticmethod
+    def __write_stream(http_response, file_handle, offset, file_size, chunk_size, hasher=None, bandwidth_limiter=None):
+        """Запись тела ответа в файл блоками фиксированного размера.
+        @param offset: количество байт, уже записанных ранее (для докачки).
+        @param file_size: полный размер файла в байтах.
+        @param hasher: объект вычисления контрольной суммы, дополняемый записанными данными.
+        @param bandwidth_limiter: ограничение скорости скачивания (throttle.BandwidthLimiter).
+        @return: количество записанных байт.
+        """
+        import progressbar
+
+        written = 0
+        write_time = 0.0
+        hash_time = 0.0
+        progress_bar = progressbar.ProgressBar(maxval=file_size).start()
+        progress_bar.update(offset)
+        try:
             for chunk in http_response.iter_content(chunk_size):
-                result += chunk
-                progress_bar.update(len(result))
-            progress_bar.finish()
-        except Exception as ex:
-            log.error('Ошибка при скачивании файла обновления.', str(ex))
+                started = time.perf_counter()
+                file_handle.write(chunk)
+                written_at = time.perf_counter()
+                write_time += written_at - started
+                if hasher is not None:
+                    hasher.update(chunk)
+                    hash_time += time.perf_counter() - written_at
+                written += len(chunk)
+                progress_bar.update(offset + written)
+                if bandwidth_limiter is not None:
+                    bandwidth_limiter.consume(len(chunk))
+        finally:
+            metrics.add('download_bytes', written)
+            metrics.add_time('write', write_time)
+            if hasher is not None:
+                metrics.add_time('hash', hash_time)
+        progress_bar.finish()
+
+        if offset + written != file_size:
+            raise IOError('Получено {0} байт из {1}.'.format(offset + written, file_size))
+
+        return written
+
+
+class AsyncApiConnector:
+    """Асинхронный вариант ApiConnector для массовой проверки доступных обновлений.
+    Методы совпадают с методами ApiConnector и выполняются в пуле потоков поверх общего
+    пула HTTP-соединений, не блокируя цикл событий asyncio.
+    """
+
+    MAX_IN_FLIGHT = 10
+
+    def __init__(self, its_login, its_password, proxy_config=None, connection_config=None, max_in_flight=None,
+                 response_cache=None, bandwidth_limiter=None, mirror_url=None):
+        """
+        @param its_login: логин учетной записи ИТС.
+        @param its_password: пароль учетной записи ИТС.
+        @param proxy_config: настройки прокси-сервера (proxySettings).
+        @param connection_config: настройки соединений (connection), см. ApiConnector.
+        @param max_in_flight: максимальное количество одновременно выполняемых запросов.
+        @param response_cache: кэш ответов проверки обновлений (cache.ResponseCache).
+        @param bandwidth_limiter: общее ограничение скорости скачивания (throttle.BandwidthLimiter).
+        @param mirror_url: адрес зеркала в локальной сети, см. ApiConnector.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.__max_in_flight = self.MAX_IN_FLIGHT if max_in_flight is None else max(1, max_in_flight)
+
+        # Пул соединений должен вмещать все одновременно выполняемые запросы
+        connection_config = dict() if connection_config is None else dict(connection_config)
+        connection_config["poolSize"] = max(connection_config.get("poolSize", 10), self.__max_in_flight)
+
+        self.__connector = ApiConnector(its_login, its_password, proxy_config, connection_config, response_cache,
+                                        bandwidth_limiter, mirror_url)
+        self.__executor = ThreadPoolExecutor(max_workers=self.__max_in_flight)
+
+
+    def close(self):
+        """Остановка пула потоков и закрытие соединений."""
+        self.__executor.shutdown(wait=True)
+        self.__connector.close()
+
+
+    async def __call(self, method, *args, **kwargs):
+        """Выполнение метода ApiConnector в пуле потоков."""
+        import asyncio
+        import functools
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, functools.partial(method, *args, **kwargs))
+
+
+    async def check_platform_update(self, current_version, use_cache=True):
+        """См. ApiConnector.check_platform_update()."""
+        return await self.__call(self.__connector.check_platform_update, current_version, use_cache)
+
+
+    async def check_conf_update(self, conf_name, conf_version, use_cache=True):
+        """См. ApiConnector.check_conf_update()."""
+        return await self.__call(self.__connector.check_conf_update, conf_name, conf_version, use_cache)
+
+
+    async def get_platform_download_url(self, distribution_uin):
+        """См. ApiConnector.get_platform_download_url()."""
+        return await self.__call(self.__connector.get_platform_download_url, distribution_uin)
+
+
+    async def get_conf_download_data(self, distribution_uin, program_uin):
+        """См. ApiConnector.get_conf_download_data()."""
+        return await self.__call(self.__connector.get_conf_download_data, distribution_uin, program_uin)
+
+
+    async def download_file(self, url, target, **kwargs):
+        """См. ApiConnector.download_file()."""
+        return await self.__call(self.__connector.download_file, url, target, **kwargs)
+
+
+    async def check_many(self, checks, max_in_flight=None):
+        """Одновременная проверка обновлений для списка конфигураций и версий.
+        Результаты возвращаются по мере получения ответов, а не в порядке запросов.
+        @param checks: список пар (programName, versionNumber).
+        @param max_in_flight: ограничение одновременно выполняемых запросов
+                              (не больше заданного при создании коннектора).
+        @return: асинхронный генератор кортежей (programName, versionNumber, результат check_conf_update()).
+        """
+        import asyncio
+
+        limit = self.__max_in_flight if max_in_flight is None else max(1, min(max_in_flight, self.__max_in_flight))
+        semaphore = asyncio.Semaphore(limit)
+
+        async def check(conf_name, conf_version):
+            async with semaphore:
+                return conf_name, conf_version, await self.check_conf_update(conf_name, conf_version)
 
-        return bytes(result)
+        for future in asyncio.as_completed([check(conf_name, conf_version) for conf_name, conf_version in checks]):
+            yield await future
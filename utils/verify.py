@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+from os.path import join as join_path
+from utils import cache, log, metrics, state
+
+TEMPLATE_FILE_NAME = "1cv8.zip"
+
+
+def stored_archives(settings: dict):
+    """Архивы хранилища обновлений: 1cv8.zip каталога templatePath и <версия>.zip каталога platformPath.
+    @param settings: настройки обновления в виде словаря.
+    @return: список полных путей к архивам.
+    """
+    paths = []
+    for root, _, names in os.walk(settings["templatePath"]):
+        if TEMPLATE_FILE_NAME in names:
+            paths.append(os.path.abspath(join_path(root, TEMPLATE_FILE_NAME)))
+
+    platform_path = settings["platformPath"]
+    if os.path.isdir(platform_path):
+        paths += [os.path.abspath(join_path(platform_path, name)) for name in os.listdir(platform_path)
+                  if name.lower().endswith('.zip') and os.path.isfile(join_path(platform_path, name))]
+    return sorted(paths)
+
+
+def scan(settings: dict, state_store, workers=1, use_index=True):
+    """Проверка целостности архивов хранилища обновлений.
+    Размер и контрольная сумма каждого архива сверяются с данными, сохраненными при скачивании.
+    Контрольные суммы вычисляются параллельно через отображение файлов в память и запоминаются
+    вместе с размером и временем изменения файла, поэтому неизменившиеся файлы при следующих
+    проверках не хешируются. Поврежденные и отсутствующие архивы отмечаются в хранилище
+    состояния и скачиваются повторно при следующем запуске (см. worker.repair_files()).
+    @param settings: настройки обновления в виде словаря.
+    @param state_store: хранилище хода скачивания (state.StateStore).
+    @param workers: количество потоков вычисления контрольных сумм.
+    @param use_index: использовать контрольные суммы предыдущих проверок для неизменившихся файлов.
+    @return: отчет в виде словаря {"files": проверено архивов, "hashed": вычислено контрольных сумм,
+             "broken": поврежденных и отсутствующих архивов, "unknown": архивов без сведений о скачивании}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    report = {"files": 0, "hashed": 0, "broken": 0, "unknown": 0}
+    paths = stored_archives(settings)
+
+    def check(path):
+        """Проверка одного архива; возвращает признак (FILE_OK/FILE_BROKEN/None) и признак хеширования."""
+        record = state_store.file(path)
+        stat = os.stat(path)
+        if record is not None and record["size"] != stat.st_size:
+            log.warn(' -- Размер архива %s (%s байт) не совпадает с ожидаемым (%s байт).',
+                     path, stat.st_size, record["size"])
+            return state.FILE_BROKEN, False
+        if record is None or record["hash_sum"] is None:
+            # Сверять контрольную сумму не с чем - проверяется только размер
+            return (None if record is None else state.FILE_OK), False
+
+        hashed = False
+        hash_sum = state_store.indexed_hash(path, stat.st_size, stat.st_mtime_ns) if use_index else None
+        if hash_sum is None:
+            hash_sum = cache.hash_sum(cache.mapped_file_hash(path))
+            state_store.set_indexed_hash(path, stat.st_size, stat.st_mtime_ns, hash_sum)
+            hashed = True
+
+        if hash_sum != record["hash_sum"]:
+            log.warn(' -- Контрольная сумма архива %s не совпадает с ожидаемой.', path)
+            return state.FILE_BROKEN, hashed
+        return state.FILE_OK, hashed
+
+    def check_safe(path):
+        try:
+            return check(path)
+        except OSError as ex:
+            log.error('Ошибка проверки архива %s. %s', path, ex)
+            return None, False
+
+    log.info(' > Проверка целостности архивов (%s).', len(paths))
+    with metrics.timer('verify'), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(check_safe, paths))
+
+    for path, (status, hashed) in zip(paths, results):
+        report["files"] += 1
+        report["hashed"] += 1 if hashed else 0
+        if status is None:
+            report["unknown"] += 1
+            continue
+        record = state_store.file(path)
+        if record is not None and record["status"] != status:
+            state_store.set_file_status(path, status)
+        if status == state.FILE_BROKEN:
+            report["broken"] += 1
+
+    # Архивы, зафиксированные при скачивании, но удаленные с диска
+    found = set(paths)
+    for record in state_store.files():
+        if record["path"] not in found and not os.path.isfile(record["path"]):
+            log.warn(' -- Архив %s отсутствует.', record["path"])
+            if record["status"] != state.FILE_BROKEN:
+                state_store.set_file_status(record["path"], state.FILE_BROKEN)
+            report["broken"] += 1
+
+    metrics.add('verify_files', report["files"])
+    metrics.add('verify_broken', report["broken"])
+    log.info(' < Проверка целостности завершена: архивов %s, вычислено контрольных сумм %s, '
+             'повреждено %s, без сведений о скачивании %s.',
+             report["files"], report["hashed"], report["broken"], report["unknown"])
+    return report
@@ -2,8 +2,14 @@
 
 import json
 import os
+import shutil
+import threading
 from os.path import join as join_path
-from utils import log
+from utils import cache, dedup, log, metrics, mirror, pipeline, state, throttle, updateapi
+
+UNZIP_BUFFER_SIZE = 1024 * 1024
+# Суффикс временного имени распаковываемого файла
+UNZIP_TMP_SUFFIX = ".unzip.tmp"
 
 def init_settings():
     """Чтение настроек обновления из конфигурационного файла settings.json.
@@ -16,56 +22,208 @@ def init_settings():
     return settings_dict
 
 
-def save_settings(settings_dict):
-    """Запись настроек обновления в конфигурационный файл settings.json.
-    @param settings_dict: настройки обновления в виде словаря.
+def open_state(settings: dict):
+    """Открытие хранилища хода скачивания обновлений.
+    @param settings: настройки обновления в виде словаря (путь к базе задается параметром statePath).
+    @return: объект state.StateStore.
+    """
+    return state.StateStore(settings.get("statePath", "state.db"))
+
+
+def configured_versions(version_settings: dict):
+    """Версии из settings.json для сравнения с предыдущим запуском (см. state.StateStore.last_downloaded()).
+    @param version_settings: настройки платформы или конфигурации (startVersion, lastDownloaded).
+    @return: строка с начальной и последней скачанной версией.
     """
-    with open('settings.json', 'w', encoding='utf-8') as file_handle:
-        # преобразовываем словарь в unicode-строку и записываем в файл
-        file_handle.write(json.dumps(settings_dict, ensure_ascii=False))
+    return '{0}|{1}'.format(version_settings["startVersion"], version_settings["lastDownloaded"])
 
 
-def unzip_unicode(zip_path, directory=None, remove=True):
+def create_connector(settings: dict, use_response_cache=True):
+    """Создание коннектора к сервису 1С по настройкам обновления.
+    @param settings: настройки обновления в виде словаря.
+    @param use_response_cache: использовать кэш ответов проверки обновлений (responseCache).
+    @return: объект updateapi.ApiConnector.
+    """
+    response_cache = None
+    cache_settings = settings.get("responseCache")
+    if use_response_cache and (not cache_settings is None) and cache_settings.get("enabled", True):
+        response_cache = cache.ResponseCache(cache_settings["path"],
+                                             cache_settings.get("ttl", 3600),
+                                             cache_settings.get("maxEntries", 1000))
+
+    return updateapi.ApiConnector(settings["itsUsername"],
+                                  settings["itsPassword"],
+                                  settings["proxySettings"],
+                                  settings.get("connection"),
+                                  response_cache,
+                                  throttle.BandwidthLimiter.from_settings(settings.get("bandwidthLimit")),
+                                  settings.get("mirror", dict()).get("upstream"))
+
+
+def run_update(connector, settings: dict):
+    """Полный цикл проверки и скачивания обновлений конфигураций и платформы
+    с выводом итогов и выгрузкой показателей.
+    @param connector: коннектор к сервису 1С.
+    @param settings: настройки обновления в виде словаря.
+    """
+    # Хранилище хода скачивания (последние скачанные версии и обработанные элементы цепочек)
+    state_store = open_state(settings)
+    # Дедупликация распакованных файлов, манифест которой записывается один раз в конце запуска
+    deduplicator = dedup.FileDeduplicator.from_settings(settings) if settings["unzipFiles"] else None
+    try:
+        # Повторное скачивание архивов, поврежденных по результатам проверки целостности
+        with metrics.timer('phase', phase='repair'):
+            repair_files(connector, settings, state_store, deduplicator)
+
+        # Поиск и скачивание новых версий конфигураций 1С
+        with metrics.timer('phase', phase='configurations'):
+            update_configurations(connector, settings, state_store, deduplicator)
+
+        # Поиск и скачивание новой версии платформы 1С
+        with metrics.timer('phase', phase='platform'):
+            update_platform(connector, settings, state_store, deduplicator)
+
+        # Поиск и скачивание новых версий конфигураций 1С
+        with metrics.timer('phase', phase='configurations'):
+            update_configurations(connector, settings, state_store, deduplicator)
+    finally:
+        if deduplicator is not None:
+            deduplicator.save()
+        state_store.close()
+
+    # Итоги запуска и выгрузка показателей для построения графиков и оповещений
+    metrics.summary()
+    metrics_settings = settings.get("metrics", dict())
+    if metrics_settings.get("jsonPath"):
+        metrics.export_json(metrics_settings["jsonPath"])
+    if metrics_settings.get("prometheusPath"):
+        metrics.export_prometheus(metrics_settings["prometheusPath"])
+
+
+def download_options(settings: dict):
+    """Параметры скачивания файлов для ApiConnector.download_file().
+    @param settings: настройки обновления в виде словаря (размеры downloadChunkSize и
+                     downloadSegmentSize задаются в Мб).
+    @return: словарь именованных параметров скачивания.
+    """
+    return {"chunk_size": int(settings.get("downloadChunkSize", 1) * 1024 * 1024),
+            "attempts": settings.get("downloadAttempts"),
+            "segments": settings.get("downloadSegments", 1),
+            "segment_size": int(settings.get("downloadSegmentSize", 16) * 1024 * 1024)}
+
+
+def unzip_unicode(zip_path, directory=None, remove=True, workers=1):
     """Разархивирование архива с именами файлов в формате Unicode.
+    Файлы распаковываются потоково блоками по UNZIP_BUFFER_SIZE байт в нескольких потоках,
+    каждый поток работает со своим экземпляром ZipFile.
     @param zip_path: полный путь к архиву.
     @param directory: директория в которую разархивировать файл.
     @param remove: удалить файл после разархивирования.
+    @param workers: количество потоков распаковки.
+    @return: список полных путей к распакованным файлам.
+    @raise IOError: если хотя бы один файл архива не распакован (архив нельзя считать обработанным).
     """
     import zipfile
+    from concurrent.futures import ThreadPoolExecutor
 
     # По умолчанию распаковываем в текущий каталог
     unzip_dir = os.path.dirname(zip_path)
     if not directory is None:
         unzip_dir = directory
 
-    upd_zip = zipfile.ZipFile(zip_path)
-    for name in upd_zip.namelist():
-        unicode_name = name.encode('cp437').decode('cp866').replace('/', '\\')
-        dirs = os.path.dirname(join_path(unzip_dir, unicode_name))
-        if dirs and not os.path.exists(dirs):
-            os.makedirs(dirs)
-
-        try:
-            with open(join_path(unzip_dir, unicode_name), 'wb') as file_handle:
-                file_handle.write(upd_zip.read(name))
-                file_handle.close()
-        except IOError as ex:
-            log.error('Ошибка распаковки файла.', str(ex))
-    upd_zip.close()
+    with zipfile.ZipFile(zip_path) as upd_zip:
+        members = upd_zip.infolist()
+
+    # Каталоги создаются один раз до начала распаковки
+    targets = []
+    created_dirs = set()
+    for info in members:
+        unicode_name = info.filename
+        if not info.flag_bits & 0x800:
+            unicode_name = unicode_name.encode('cp437').decode('cp866')
+        target = join_path(unzip_dir, unicode_name.replace('/', os.sep))
+
+        dirs = target if info.is_dir() else os.path.dirname(target)
+        if dirs and dirs not in created_dirs:
+            os.makedirs(dirs, exist_ok=True)
+            created_dirs.add(dirs)
+
+        if not info.is_dir():
+            targets.append((info, target))
+
+    # Распределение файлов по потокам с выравниванием по суммарному размеру
+    workers = max(1, min(workers, len(targets)))
+    buckets = [[] for _ in range(workers)]
+    bucket_sizes = [0] * workers
+    for info, target in sorted(targets, key=lambda item: item[0].file_size, reverse=True):
+        index = bucket_sizes.index(min(bucket_sizes))
+        buckets[index].append((info, target))
+        bucket_sizes[index] += info.file_size
+
+    failed = []
+
+    def extract(bucket):
+        with zipfile.ZipFile(zip_path) as worker_zip:
+            for info, target in bucket:
+                # Файл пишется под временным именем и заменяет существующий целиком: запись поверх
+                # жесткой ссылки дедупликации испортила бы связанные файлы других версий
+                tmp_path = target + UNZIP_TMP_SUFFIX
+                try:
+                    with worker_zip.open(info) as source, open(tmp_path, 'wb') as file_handle:
+                        shutil.copyfileobj(source, file_handle, UNZIP_BUFFER_SIZE)
+                    os.replace(tmp_path, target)
+                except Exception as ex:
+                    log.error('Ошибка распаковки файла %s. %s', target, ex)
+                    failed.append(target)
+                    if os.path.isfile(tmp_path):
+                        os.remove(tmp_path)
+
+    with metrics.timer('extract'):
+        if workers == 1:
+            extract(buckets[0])
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(extract, buckets))
+
+    if failed:
+        raise IOError('Не распаковано файлов архива {0}: {1} из {2}.'.format(zip_path, len(failed), len(targets)))
+
+    metrics.add('extract_files', len(targets))
+    metrics.add('extract_bytes', sum(bucket_sizes))
+    return [target for _, target in targets]
+
+
+def deduplicate_files(deduplicator, paths):
+    """Дедупликация распакованных файлов с выводом отчета в лог.
+    @param deduplicator: объект дедупликации (dedup.FileDeduplicator) или None, если она отключена.
+    @param paths: полные пути к распакованным файлам.
+    """
+    if deduplicator is None:
+        return
+    report = deduplicator.deduplicate(paths)
+    log.info(' ---- Дедупликация: учтено файлов %s, заменено ссылками %s, освобождено %.2f Мб.',
+             report["files"], report["linked"], report["savedBytes"] / 1024 / 1024)
 
 
-def update_platform(connector, settings: dict):
+def update_platform(connector, settings: dict, state_store=None, deduplicator=None):
     """Скачивание текущей релизной версии платформы 1С.
     @param connector: коннектор к сервису 1С.
     @param settings: настройки обновления в виде словаря.
+    @param state_store: хранилище хода скачивания (state.StateStore), по умолчанию open_state().
+    @param deduplicator: дедупликация распакованных файлов (dedup.FileDeduplicator).
     """
+    if state_store is None:
+        with open_state(settings) as state_store:
+            return update_platform(connector, settings, state_store, deduplicator)
+
     log.info(' > Начало обновления платформы 1С.')
-    platform_settings = settings["platform"].copy()
+    platform_settings = settings["platform"]
 
     # Вычисление начальной версии, с которой начинать проверку
-    check_version = platform_settings["startVersion"]
-    if not platform_settings["lastDownloaded"] == "":
-        check_version = platform_settings["lastDownloaded"]
+    check_version = state_store.last_downloaded(state.PLATFORM, "Platform", platform_settings["lastDownloaded"],
+                                                configured_versions(platform_settings))
+    if check_version == "":
+        check_version = platform_settings["startVersion"]
 
     # Получение информации об обновлении платформы с сайте 1С
     upd_conf = connector.check_platform_update(check_version)
@@ -79,96 +237,295 @@ def update_platform(connector, settings: dict):
         log.info(' < Обновление платформы 1С завершено.')
         return
 
-    log.info(' -- Найдена новая версия {} платформы 1С.'.format(upd_conf["platformVersion"]))
+    log.info(' -- Найдена новая версия %s платформы 1С.', upd_conf["platformVersion"])
 
     file_size = round(upd_conf["size"] / 1024 / 1024, 2)
-    log.info(' -- Размер файла обновления: {} Мб.'.format(file_size))
+    log.info(' -- Размер файла обновления: %s Мб.', file_size)
+
+    filename = "{0}.zip".format(upd_conf["platformVersion"])
+    full_path = join_path(settings["platformPath"], filename)
+    log.info(' -- Полный путь для сохранения: %s', full_path)
 
     log.info(' -- Скачивания архива с платформой 1С...')
     platform_url = connector.get_platform_download_url(upd_conf["distributionUin"])
-    platform_binary = connector.download_file(platform_url)
+    downloaded = None
+    if not platform_url is None:
+        downloaded = connector.download_file(platform_url, full_path, expected_size=upd_conf["size"],
+                                             mirror_path=mirror.file_path(mirror.PLATFORM_PREFIX, filename),
+                                             **download_options(settings))
+    if downloaded is None:
+        log.info(' -- Не удалось скачать архив с платформой 1С.')
+        log.info(' < Обновление платформы 1С завершено.')
+        return
     log.info(' -- Скачивания архива с платформой 1С... Завершено!')
 
-    log.info(' -- Сохранение архива на диск...')
-    filename = "{0}.zip".format(upd_conf["platformVersion"])
-    full_path = join_path(settings["platformPath"], filename)
-    log.info(' -- Полный путь для сохранения: {}'.format(full_path))
-
-    new_file = open(full_path, "wb")
-    new_file.write(platform_binary)
-    new_file.close()
-    log.info(' -- Сохранение архива на диск... Завершено!')
+    state_store.set_file(os.path.abspath(full_path), state.PLATFORM, "Platform", upd_conf["platformVersion"],
+                         upd_conf["distributionUin"], None, upd_conf["size"])
 
     if settings["unzipFiles"]:
         log.info(' -- Распаковка архива...')
-        unzip_unicode(full_path)
+        try:
+            extracted = unzip_unicode(full_path, workers=concurrency_limits(settings)["unzipThreads"])
+        except Exception as ex:
+            # Версия не фиксируется, распаковка будет повторена при следующем запуске
+            log.error(' -- Ошибка распаковки архива с платформой 1С. %s', ex)
+            log.info(' < Обновление платформы 1С завершено.')
+            return
         log.info(' -- Распаковка архива... Завершено!')
+        deduplicate_files(deduplicator, extracted)
 
-    platform_settings["lastDownloaded"] = upd_conf["platformVersion"]
-    settings["platform"] = platform_settings
-    save_settings(settings)
+    state_store.set_last_downloaded(state.PLATFORM, "Platform", upd_conf["platformVersion"])
 
     log.info(' < Обновление платформы 1С завершено.')
 
 
-def update_configurations(connector, settings: dict):
-    """Скачивание обновлений для всех конфигураций, указанных в настройке.
+def repair_files(connector, settings: dict, state_store, deduplicator=None):
+    """Повторное скачивание архивов, отмеченных поврежденными при проверке целостности (см. verify.scan()).
+    Ссылка на скачивание запрашивается заново по идентификаторам, сохраненным при первом скачивании.
     @param connector: коннектор к сервису 1С.
     @param settings: настройки обновления в виде словаря.
+    @param state_store: хранилище хода скачивания (state.StateStore).
+    @param deduplicator: дедупликация распакованных файлов (dedup.FileDeduplicator).
     """
-    for configuration in settings["configurations"]:
-        log.info(' > Начало обновления конфигурации "{}".'.format(configuration["humanName"]))
-
-        # Вычисление начальной версии, с которой начинать проверку
-        check_version = configuration["startVersion"]
-        if not configuration["lastDownloaded"] == "":
-            check_version = configuration["lastDownloaded"]
+    broken = state_store.files(state.FILE_BROKEN)
+    if not broken:
+        return
 
-        upd_conf = connector.check_conf_update(configuration["programName"], check_version)
-        if upd_conf is None:
-            log.info(' --  Обновление для текущей версии конфигурации не найдено.')
-            log.info(' < Обновление конфигурации завершено.')
+    log.info(' > Повторное скачивание поврежденных архивов (%s).', len(broken))
+    download_cache = cache.DownloadCache(settings.get("cachePath"))
+    for record in broken:
+        full_path = record["path"]
+        if record["kind"] == state.PLATFORM:
+            download_url = connector.get_platform_download_url(record["sequence"])
+            mirror_path = mirror.file_path(mirror.PLATFORM_PREFIX, os.path.basename(full_path))
+        else:
+            download_conf = connector.get_conf_download_data(record["sequence"], record["program_uin"])
+            download_url = None if download_conf is None else download_conf["updateFileUrl"]
+            mirror_path = None if download_conf is None else \
+                mirror.file_path(mirror.TEMPLATE_PREFIX, download_conf["templatePath"], os.path.basename(full_path))
+        if download_url is None:
+            log.info(' -- Не удалось получить ссылку для повторного скачивания архива %s.', full_path)
             continue
 
-        if (upd_conf["configurationVersion"] is None) or upd_conf["configurationVersion"] == check_version:
-            log.info(' -- Текущая версия конфигурации является актуальной.')
-            log.info(' < Обновление конфигурации завершено.')
+        # Поврежденный архив мог попасть в кэш скачанных файлов (или быть взят из него)
+        if not record["hash_sum"] is None:
+            download_cache.discard(record["hash_sum"])
+        if os.path.isfile(full_path):
+            os.remove(full_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        log.info(' -- Повторное скачивание архива %s...', full_path)
+        downloaded = connector.download_file(download_url, full_path, expected_size=record["size"],
+                                             expected_hash=record["hash_sum"], mirror_path=mirror_path,
+                                             **download_options(settings))
+        if downloaded is None:
+            log.info(' -- Не удалось повторно скачать архив %s.', full_path)
             continue
 
-        log.info(' -- Найдена новая версия "{}" конфигурации.'.format(upd_conf["configurationVersion"]))
-        log.info(' -- Скачивание цепочки обновлений...')
-
-        for sequence in upd_conf["upgradeSequence"]:
-            download_conf = connector.get_conf_download_data(sequence, upd_conf["programVersionUin"])
-            if download_conf is None:
-                log.info(' ---- Не удалось скачать обновление с uid={}.'.format(sequence))
+        if not record["hash_sum"] is None:
+            download_cache.add(record["hash_sum"], record["size"], full_path)
+        if settings["unzipFiles"]:
+            try:
+                extracted = unzip_unicode(full_path, workers=concurrency_limits(settings)["unzipThreads"])
+            except Exception as ex:
+                log.error(' -- Ошибка распаковки архива %s. %s', full_path, ex)
                 continue
+            deduplicate_files(deduplicator, extracted)
+        state_store.set_file_status(full_path, state.FILE_OK)
+        log.info(' -- Повторное скачивание архива %s... Завершено!', full_path)
+
+    log.info(' < Повторное скачивание поврежденных архивов завершено.')
+
+
+def concurrency_limits(settings: dict):
+    """Ограничения параллельной обработки конфигураций из настройки concurrency.
+    @param settings: настройки обновления в виде словаря.
+    @return: словарь с количеством одновременно обрабатываемых конфигураций (configurations),
+             потоков распаковки одного архива (unzipThreads), потоков проверки целостности
+             архивов (verifyThreads), длиной очередей конвейера
+             цепочки обновлений (pipelineQueue) и семафорами для запросов
+             к API (apiCalls), скачиваний (downloads) и распаковки (unzip).
+    """
+    concurrency = settings.get("concurrency", dict())
+    return {"configurations": max(1, concurrency.get("configurations", 1)),
+            "apiCalls": threading.BoundedSemaphore(max(1, concurrency.get("apiCalls", 1))),
+            "downloads": threading.BoundedSemaphore(max(1, concurrency.get("downloads", 1))),
+            "unzip": threading.BoundedSemaphore(max(1, concurrency.get("unzip", 1))),
+            "unzipThreads": max(1, concurrency.get("unzipThreads", 1)),
+            "verifyThreads": max(1, concurrency.get("verifyThreads", 1)),
+            "pipelineQueue": max(1, concurrency.get("pipelineQueue", 1))}
+
+
+def update_configurations(connector, settings: dict, state_store=None, deduplicator=None):
+    """Скачивание обновлений для всех конфигураций, указанных в настройке.
+    Конфигурации обрабатываются параллельно в пуле потоков, количество одновременных
+    запросов к API, скачиваний и распаковок ограничивается настройкой concurrency.
+    @param connector: коннектор к сервису 1С.
+    @param settings: настройки обновления в виде словаря.
+    @param state_store: хранилище хода скачивания (state.StateStore), по умолчанию open_state().
+    @param deduplicator: дедупликация распакованных файлов (dedup.FileDeduplicator).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if state_store is None:
+        with open_state(settings) as state_store:
+            return update_configurations(connector, settings, state_store, deduplicator)
+
+    limits = concurrency_limits(settings)
+    download_cache = cache.DownloadCache(settings.get("cachePath"))
+    with ThreadPoolExecutor(max_workers=limits["configurations"]) as executor:
+        futures = [executor.submit(update_configuration, connector, settings, configuration, limits,
+                                   download_cache, state_store, deduplicator)
+                   for configuration in settings["configurations"]]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as ex:
+                log.error('Ошибка при обновлении конфигурации. %s', ex)
+
+
+def update_configuration(connector, settings: dict, configuration: dict, limits: dict, download_cache=None,
+                         state_store=None, deduplicator=None):
+    """Скачивание цепочки обновлений одной конфигурации.
+    Элементы цепочки обрабатываются конвейером (получение ссылки, скачивание, проверка,
+    распаковка), ход обработки каждого элемента фиксируется в хранилище состояния,
+    уже обработанные элементы пропускаются. Отметка о скачанной версии сохраняется
+    только после успешной обработки всей цепочки.
+    @param connector: коннектор к сервису 1С.
+    @param settings: настройки обновления в виде словаря.
+    @param configuration: настройки конфигурации из списка settings["configurations"].
+    @param limits: ограничения параллельной обработки, см. concurrency_limits().
+    @param download_cache: кэш скачанных архивов (cache.DownloadCache).
+    @param state_store: хранилище хода скачивания (state.StateStore), по умолчанию open_state().
+    @param deduplicator: дедупликация распакованных файлов (dedup.FileDeduplicator).
+    """
+    if download_cache is None:
+        download_cache = cache.DownloadCache()
+    if state_store is None:
+        with open_state(settings) as state_store:
+            return update_configuration(connector, settings, configuration, limits, download_cache, state_store,
+                                        deduplicator)
+
+    log.info(' > Начало обновления конфигурации "%s".', configuration["humanName"])
+
+    # Вычисление начальной версии, с которой начинать проверку
+    program_name = configuration["programName"]
+    check_version = state_store.last_downloaded(state.CONFIGURATION, program_name, configuration["lastDownloaded"],
+                                                configured_versions(configuration))
+    if check_version == "":
+        check_version = configuration["startVersion"]
 
-            log.info(' -- > Скачивание цепочки {}...'.format(download_conf["templatePath"]))
-            file_size = round(download_conf["size"] / 1024 / 1024, 2)
-            log.info(' ---- Размер файла обновления: {} Мб.'.format(file_size))
-
-            log.info(' ---- Скачивание файла обновления...')
-            conf_binary = connector.download_file(download_conf["updateFileUrl"])
-            log.info(' ---- Скачивание файла обновления... Завершено!')
-
-            log.info(' ---- Сохранение архива на диск...')
-            directory_path = join_path(settings["templatePath"], download_conf["templatePath"])
-            os.makedirs(directory_path, exist_ok=True)
-            full_path = join_path(directory_path, "1cv8.zip")
-            log.info(' ---- Полный путь для сохранения: {}'.format(full_path))
-
-            new_file = open(full_path, "wb")
-            new_file.write(conf_binary)
-            new_file.close()
-            log.info(' ---- Сохранение архива на диск... Завершено!')
-
-            if settings["unzipFiles"]:
-                log.info(' ---- Распаковка архива...')
-                unzip_unicode(full_path)
-                log.info(' ---- Распаковка архива... Завершено!')
-
-        log.info(' -- < Скачивание цепочки обновлений... Завершено!')
-        log.info(' < Обновление конфигурации завершено.')
-        configuration["lastDownloaded"] = upd_conf["configurationVersion"]
-        save_settings(settings)
+    with limits["apiCalls"]:
+        upd_conf = connector.check_conf_update(program_name, check_version)
+    if upd_conf is None:
+        log.info(' --  Обновление для текущей версии конфигурации "%s" не найдено.', configuration["humanName"])
+        log.info(' < Обновление конфигурации "%s" завершено.', configuration["humanName"])
+        return
+
+    if (upd_conf["configurationVersion"] is None) or upd_conf["configurationVersion"] == check_version:
+        log.info(' -- Текущая версия конфигурации "%s" является актуальной.', configuration["humanName"])
+        log.info(' < Обновление конфигурации "%s" завершено.', configuration["humanName"])
+        return
+
+    log.info(' -- Найдена новая версия "%s" конфигурации "%s".', upd_conf["configurationVersion"], configuration["humanName"])
+    log.info(' -- Скачивание цепочки обновлений...')
+    target_version = upd_conf["configurationVersion"]
+    final_stage = state.STAGE_EXTRACTED if settings["unzipFiles"] else state.STAGE_DOWNLOADED
+    skipped = []
+
+    def resolve(sequence):
+        """Этап конвейера: получение данных для скачивания элемента цепочки."""
+        stage = state_store.chain_stage(program_name, target_version, sequence)
+        if stage == final_stage or stage == state.STAGE_EXTRACTED:
+            log.info(' ---- Обновление с uid=%s уже обработано.', sequence)
+            skipped.append(sequence)
+            return None
+
+        with limits["apiCalls"]:
+            download_conf = connector.get_conf_download_data(sequence, upd_conf["programVersionUin"])
+        if download_conf is None:
+            log.info(' ---- Не удалось скачать обновление с uid=%s.', sequence)
+            return None
+
+        file_size = round(download_conf["size"] / 1024 / 1024, 2)
+        log.info(' -- > Цепочка %s, размер файла обновления: %s Мб.', download_conf["templatePath"], file_size)
+
+        directory_path = join_path(settings["templatePath"], download_conf["templatePath"])
+        os.makedirs(directory_path, exist_ok=True)
+        download_conf["fullPath"] = join_path(directory_path, "1cv8.zip")
+        download_conf["sequence"] = sequence
+        log.info(' ---- Полный путь для сохранения: %s', download_conf["fullPath"])
+        return download_conf
+
+    def download(download_conf):
+        """Этап конвейера: скачивание архива (или получение его из кэша)."""
+        full_path = download_conf["fullPath"]
+
+        # Один и тот же архив может входить в цепочки нескольких конфигураций
+        with download_cache.lock(download_conf["hashSum"]):
+            if download_cache.fetch(download_conf["hashSum"], download_conf["size"], full_path):
+                log.info(' ---- Файл обновления %s взят из кэша.', full_path)
+                download_conf["cached"] = True
+                return download_conf
+
+            log.info(' ---- Скачивание файла обновления %s...', full_path)
+            with limits["downloads"]:
+                downloaded = connector.download_file(download_conf["updateFileUrl"], full_path,
+                                                     expected_size=download_conf["size"],
+                                                     expected_hash=download_conf["hashSum"],
+                                                     mirror_path=mirror.file_path(mirror.TEMPLATE_PREFIX,
+                                                                                  download_conf["templatePath"],
+                                                                                  "1cv8.zip"),
+                                                     **download_options(settings))
+            if downloaded is None:
+                log.info(' ---- Не удалось скачать файл обновления %s.', download_conf["updateFileUrl"])
+                return None
+            log.info(' ---- Скачивание файла обновления %s... Завершено!', full_path)
+
+        download_conf["cached"] = False
+        return download_conf
+
+    def verify(download_conf):
+        """Этап конвейера: проверка архива на диске и регистрация его в кэше.
+        Контрольная сумма сверяется при скачивании, здесь проверяется наличие и размер файла."""
+        full_path = download_conf["fullPath"]
+        # Файл с тем же архивом может одновременно размещаться цепочкой другой конфигурации
+        with download_cache.lock(download_conf["hashSum"]):
+            if not os.path.isfile(full_path) or os.path.getsize(full_path) != download_conf["size"]:
+                log.info(' ---- Файл обновления %s поврежден или отсутствует.', full_path)
+                return None
+
+            if not download_conf["cached"]:
+                download_cache.add(download_conf["hashSum"], download_conf["size"], full_path)
+        state_store.set_file(os.path.abspath(full_path), state.CONFIGURATION, program_name, target_version,
+                             download_conf["sequence"], upd_conf["programVersionUin"], download_conf["size"],
+                             download_conf["hashSum"])
+        state_store.set_chain_stage(program_name, target_version, download_conf["sequence"],
+                                    state.STAGE_DOWNLOADED, download_conf["templatePath"])
+        return download_conf
+
+    def extract(download_conf):
+        """Этап конвейера: распаковка архива."""
+        full_path = download_conf["fullPath"]
+        log.info(' ---- Распаковка архива %s...', full_path)
+        with download_cache.lock(download_conf["hashSum"]), limits["unzip"]:
+            extracted = unzip_unicode(full_path, workers=limits["unzipThreads"])
+        log.info(' ---- Распаковка архива %s... Завершено!', full_path)
+        deduplicate_files(deduplicator, extracted)
+        state_store.set_chain_stage(program_name, target_version, download_conf["sequence"],
+                                    state.STAGE_EXTRACTED, download_conf["templatePath"])
+        return download_conf
+
+    # Пока распаковывается элемент N, скачивается элемент N+1
+    chain = pipeline.Pipeline(configuration["humanName"], limits["pipelineQueue"])
+    chain.add_stage('resolve', resolve).add_stage('download', download).add_stage('verify', verify)
+    if settings["unzipFiles"]:
+        chain.add_stage('extract', extract)
+    processed = chain.run(upd_conf["upgradeSequence"])
+
+    log.info(' -- < Скачивание цепочки обновлений "%s"... Завершено!', configuration["humanName"])
+    if len(processed) + len(skipped) == len(upd_conf["upgradeSequence"]):
+        state_store.set_last_downloaded(state.CONFIGURATION, program_name, target_version)
+    else:
+        log.info(' -- Цепочка обновлений "%s" обработана не полностью, оставшиеся элементы будут скачаны при следующем запуске.', configuration["humanName"])
+    log.info(' < Обновление конфигурации "%s" завершено.', configuration["humanName"])